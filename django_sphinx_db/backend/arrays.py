@@ -0,0 +1,75 @@
+# coding: utf-8
+""" Columnar export of attribute values to NumPy arrays.
+
+Rows are read from unbuffered cursor by chunks and written column by column
+to preallocated typed arrays, so no model instances or value tuples are
+kept for the whole result.
+"""
+from django.db import models
+
+from django_sphinx_db.backend.fields import UnixTimestampField
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# field class => (dtype of stored values, dtype of resulting array)
+DTYPE_MAP = (
+    (UnixTimestampField, ('int64', 'datetime64[s]')),
+    (models.BooleanField, ('bool', 'bool')),
+    (models.BigIntegerField, ('int64', 'int64')),
+    (models.IntegerField, ('uint32', 'uint32')),
+    (models.FloatField, ('float32', 'float32')),
+)
+
+# capacity of arrays for unsliced querysets, grows twice when exceeded
+DEFAULT_CAPACITY = 1000
+
+
+def is_exportable(field):
+    try:
+        get_dtypes(field)
+    except ValueError:
+        return False
+    return True
+
+
+def get_dtypes(field):
+    """ Returns (storage dtype, result dtype) for the most specific matching
+    field class. Primary key is 64-bit document id for any field class."""
+    if field.primary_key:
+        return 'int64', 'int64'
+    for klass in type(field).__mro__:
+        for field_class, dtypes in DTYPE_MAP:
+            if klass is field_class:
+                return dtypes
+    raise ValueError("Field %s of type %s can't be exported to array"
+                     % (field.name, field.__class__.__name__))
+
+
+def fill_arrays(chunks, dtypes, capacity=None):
+    """ Writes rows from chunks iterator to arrays with given dtypes.
+
+    Returns list of arrays, one per column, truncated to number of rows.
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required for array export")
+    size = capacity or DEFAULT_CAPACITY
+    arrays = [numpy.empty(size, dtype=storage) for storage, result in dtypes]
+    pos = 0
+    for rows in chunks:
+        end = pos + len(rows)
+        if end > size:
+            while end > size:
+                size *= 2
+            for array in arrays:
+                array.resize(size, refcheck=False)
+        for array, column in zip(arrays, zip(*rows)):
+            array[pos:end] = column
+        pos = end
+    result = []
+    for array, (storage, dtype) in zip(arrays, dtypes):
+        array.resize(pos, refcheck=False)
+        result.append(array.view(dtype) if dtype != storage else array)
+    return result
@@ -0,0 +1,48 @@
+# coding: utf-8
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ In-process LRU cache, entries expire after <ttl> seconds.
+
+    Used for cheap dictionary lookups like CALL KEYWORDS and CALL SUGGEST,
+    so it is thread-safe but not shared between processes.
+    """
+
+    def __init__(self, maxsize=1000, ttl=60, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires < self.timer():
+                return default
+            # moving key to the end of queue as recently used
+            self._data[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (self.timer() + self.ttl, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,128 @@
+# coding: utf-8
+""" Splitting queries with huge IN lists into chunks.
+
+Statements like "id IN (<100k values>)" exceed max_packet_size and make
+searchd parse megabytes of SQL, so such lookups are replaced by several
+queries with bounded IN lists or BETWEEN ranges for contiguous runs of
+integer values. Chunk queries are executed concurrently by a thread pool,
+each worker thread keeps its own database connection between calls.
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db.models.sql.where import AND
+
+from django_sphinx_db.backend import deadline as deadlines, memo as memos
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_chunk_size():
+    return getattr(settings, 'SPHINX_IN_CHUNK_SIZE', 5000)
+
+
+def get_pool():
+    """ Returns thread pool executing chunk queries."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'SPHINX_CHUNK_WORKERS', 4))
+    return _pool
+
+
+def map_in_pool(func, items):
+    """ Applies func to items by pool threads, query memo and deadline of
+    the caller thread are active in them, so writes invalidate the memo and
+    queries respect the time budget."""
+    memo = memos.get_memo()
+    deadline = deadlines.get_deadline()
+
+    def call(item):
+        with deadlines.activate(deadline), memos.activate(memo):
+            return func(item)
+    return get_pool().map(call, items)
+
+
+def find_in_lookup(where, threshold):
+    """ Returns (node, child) for the largest IN lookup longer than threshold.
+
+    Only lookups on unique fields combined with AND at the top of where tree
+    are inspected: only they can be evaluated as disjoint union of chunk
+    queries, each returning at most as many rows as chunk has values.
+    """
+    found = None
+    if where.negated or where.connector != AND:
+        return None
+    for child in where.children:
+        if isinstance(child, tuple):
+            constraint, lookup_type, value_annot, value = child
+            field = getattr(constraint, 'field', None)
+            if (lookup_type == 'in' and getattr(field, 'unique', False) and
+                    len(value) > threshold and
+                    (found is None or len(value) > len(found[1][3]))):
+                found = (where, child)
+        elif hasattr(child, 'children'):
+            result = find_in_lookup(child, threshold)
+            if result and (found is None or
+                           len(result[1][3]) > len(found[1][3])):
+                found = result
+    return found
+
+
+def split_values(values, chunk_size, range_min=None, range_max=None):
+    """ Splits IN lookup values into chunks.
+
+    Returns list of ('in', [values]) and ('range', (first, last)) items.
+    Contiguous runs of at least range_min integers become ranges, that are
+    at most range_max values long.
+    """
+    if range_min is None:
+        range_min = getattr(settings, 'SPHINX_IN_RANGE_MIN', 100)
+    if range_max is None:
+        range_max = getattr(settings, 'SPHINX_MAX_MATCHES_LIMIT', 100000)
+    values = sorted(set(values))
+    result = []
+    rest = values
+    if range_min and all(isinstance(v, (int, long)) for v in values):
+        rest = []
+        start = 0
+        for i in xrange(1, len(values) + 1):
+            if i < len(values) and values[i] == values[i - 1] + 1:
+                continue
+            # values[start:i] is a contiguous run
+            if i - start >= range_min:
+                for first in xrange(values[start], values[i - 1] + 1,
+                                    range_max):
+                    last = min(first + range_max - 1, values[i - 1])
+                    result.append(('range', (first, last)))
+            else:
+                rest.extend(values[start:i])
+            start = i
+    for i in xrange(0, len(rest), chunk_size):
+        result.append(('in', rest[i:i + chunk_size]))
+    return result
+
+
+def chunk_condition(column, chunk):
+    """ Returns (sql, params) of condition selecting chunk values."""
+    kind, values = chunk
+    if kind == 'range':
+        return '%s BETWEEN %%s AND %%s' % column, list(values)
+    placeholders = ', '.join(['%s'] * len(values))
+    return '%s IN (%s)' % (column, placeholders), list(values)
+
+
+def chunk_length(chunk):
+    kind, values = chunk
+    if kind == 'range':
+        return values[1] - values[0] + 1
+    return len(values)
+
+
+def sort_rows(rows, ordering):
+    """ Sorts rows in place by ordering, list of (attname, descending)."""
+    # stable sort by each key starting from the least significant one
+    for attname, descending in reversed(ordering):
+        rows.sort(key=lambda row: getattr(row, attname), reverse=descending)
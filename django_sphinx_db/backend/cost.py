@@ -0,0 +1,134 @@
+# coding: utf-8
+""" Static cost analysis of SphinxQuery before execution.
+
+Queries are classified as 'low', 'medium' or 'high' cost:
+
+* medium: no MATCH and no document id lookup (full scan), slice or
+  max_matches past SPHINX_COST_MAX_MATCHES (searchd default of 1000 matches);
+* high: no MATCH with negative filter on string attribute, IN list longer
+  than SPHINX_COST_MAX_IN values, GROUP BY on string attribute.
+
+    SPHINX_QUERY_COST = {
+        'warn': 'medium',   # log warning for queries of this cost and above
+        'raise': 'high',    # raise QueryCostError
+    }
+"""
+import re
+
+from django.conf import settings
+from django.db import models
+from django.utils.log import getLogger
+
+LEVELS = ('low', 'medium', 'high')
+
+# attr <> value added by SphinxQuerySet.notequal
+NOT_EQUAL_RE = re.compile(r'^@?(\w+) <> ')
+
+
+class QueryCostError(ValueError):
+    pass
+
+
+class Cost(object):
+    """ Cost class of query with reasons for it."""
+
+    def __init__(self):
+        self.level = 'low'
+        self.reasons = []
+
+    def add(self, level, reason):
+        if LEVELS.index(level) > LEVELS.index(self.level):
+            self.level = level
+        self.reasons.append('%s: %s' % (level, reason))
+
+    def __repr__(self):
+        return '<Cost %s [%s]>' % (self.level, '; '.join(self.reasons))
+
+
+def is_string_attribute(field):
+    from django_sphinx_db.backend.models import SphinxField
+    return (isinstance(field, models.CharField) and
+            not isinstance(field, SphinxField))
+
+
+def get_field_by_column(model, column):
+    for field in model._meta.concrete_fields:
+        if field.column == column or field.attname == column:
+            return field
+    return None
+
+
+def iter_where(node):
+    """ Yields lookup tuples and extra where nodes of where tree."""
+    for child in node.children:
+        if isinstance(child, tuple) or hasattr(child, 'sqls'):
+            yield child
+        elif hasattr(child, 'children'):
+            for item in iter_where(child):
+                yield item
+
+
+def analyze(query):
+    """ Returns Cost of SphinxQuery."""
+    cost = Cost()
+    model = query.model
+    has_match = bool(getattr(query, 'match', None))
+    has_id_lookup = False
+    max_in = getattr(settings, 'SPHINX_COST_MAX_IN', 1000)
+    for child in iter_where(query.where):
+        if not isinstance(child, tuple):
+            for sql in child.sqls:
+                found = NOT_EQUAL_RE.match(sql)
+                if not found or has_match:
+                    continue
+                field = get_field_by_column(model, found.group(1))
+                if field is not None and is_string_attribute(field):
+                    cost.add('high', 'negative filter on string attribute '
+                                     '%s without MATCH' % field.name)
+            continue
+        constraint, lookup_type, value_annot, value = child
+        field = getattr(constraint, 'field', None)
+        if field is model._meta.pk and lookup_type in ('exact', 'in'):
+            has_id_lookup = True
+        if (lookup_type == 'in' and hasattr(value, '__len__') and
+                len(value) > max_in):
+            cost.add('high', 'IN list of %d values' % len(value))
+    if not has_match and not has_id_lookup:
+        cost.add('medium', 'no MATCH, full scan')
+    limit = getattr(settings, 'SPHINX_COST_MAX_MATCHES', 1000)
+    options = getattr(query, 'options', None) or {}
+    max_matches = int(options.get('max_matches') or 0)
+    if max_matches > limit:
+        cost.add('medium', 'max_matches=%d' % max_matches)
+    elif (query.high_mark or 0) > limit:
+        cost.add('medium', 'slice end %d past max_matches' % query.high_mark)
+    for column in query.group_by or ():
+        field = get_field_by_column(model, column)
+        if field is not None and is_string_attribute(field):
+            cost.add('high', 'GROUP BY string attribute %s' % field.name)
+    return cost
+
+
+def check_query(query):
+    """ Logs warning or raises QueryCostError according to
+    SPHINX_QUERY_COST."""
+    config = getattr(settings, 'SPHINX_QUERY_COST', None)
+    if not config:
+        return
+    cost = analyze(query)
+    level = LEVELS.index(cost.level)
+    if 'raise' in config and level >= LEVELS.index(config['raise']):
+        raise QueryCostError("Query cost is %s: %s" % (
+            cost.level, '; '.join(cost.reasons)))
+    if 'warn' in config and level >= LEVELS.index(config['warn']):
+        logger = getLogger("django.db.backends.sphinx")
+        logger.warning(u"Query cost is %s: %s", cost.level,
+                       '; '.join(cost.reasons))
+
+
+def assert_query_cost(qs, level):
+    """ Test helper, fails if cost class of queryset is not level."""
+    cost = analyze(qs.query)
+    if cost.level != level:
+        raise AssertionError("Query cost is %s, not %s: %s" % (
+            cost.level, level, '; '.join(cost.reasons) or 'no reasons'))
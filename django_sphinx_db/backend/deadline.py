@@ -0,0 +1,104 @@
+# coding: utf-8
+""" Time budget for search queries.
+
+    with sphinx_deadline(300) as deadline:
+        results = list(qs)
+    if deadline.exceeded:
+        ...
+
+Each SELECT executed in block gets OPTION max_query_time with remaining
+milliseconds, so searchd returns partial results instead of running out of
+the budget. Queries started after the budget is spent are not sent to
+searchd and return no rows, deadline.exceeded is set then.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_local = threading.local()
+
+
+class Deadline(object):
+    """ Point of time when query budget is spent."""
+
+    def __init__(self, ms, timer=time.time):
+        self.timer = timer
+        self.expires = timer() + ms / 1000.0
+        self.exceeded = False
+
+    def remaining_ms(self):
+        return max(0, int((self.expires - self.timer()) * 1000))
+
+    def expired(self):
+        return self.remaining_ms() <= 0
+
+
+def get_deadline():
+    """ Returns deadline active in current thread or None."""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def activate(deadline):
+    """ Makes deadline active in current thread."""
+    previous = get_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+@contextmanager
+def sphinx_deadline(ms):
+    """ Limits time of queries executed in block by ms milliseconds.
+
+    Nested block can't extend the budget of outer one.
+    """
+    outer = get_deadline()
+    deadline = Deadline(ms)
+    if outer is not None:
+        deadline.expires = min(deadline.expires, outer.expires)
+    try:
+        with activate(deadline):
+            yield deadline
+    finally:
+        if outer is not None and deadline.exceeded:
+            outer.exceeded = True
+
+
+@contextmanager
+def read_timeout(connection, deadline):
+    """ Limits socket reads of connection by remaining time of deadline.
+
+    Works for drivers exposing connection socket (PyMySQL), for MySQLdb
+    read_timeout can only be set in connection OPTIONS.
+    """
+    sock = getattr(connection.connection, '_sock', None)
+    if deadline is None or sock is None:
+        yield
+        return
+    timeout = sock.gettimeout()
+    sock.settimeout(max(deadline.remaining_ms(), 1) / 1000.0)
+    try:
+        yield
+    finally:
+        sock.settimeout(timeout)
+
+
+class DeadlineMiddleware(object):
+    """ Limits time of search queries executed during request processing
+    by SPHINX_REQUEST_DEADLINE milliseconds."""
+
+    def process_request(self, request):
+        request.sphinx_deadline = _local.deadline = Deadline(
+            getattr(settings, 'SPHINX_REQUEST_DEADLINE', 300))
+
+    def process_response(self, request, response):
+        _local.deadline = None
+        return response
+
+    def process_exception(self, request, exception):
+        _local.deadline = None
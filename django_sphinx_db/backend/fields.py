@@ -1,16 +1,101 @@
 # coding: utf-8
 
+import json
+import re
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
-from datetime import datetime
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from datetime import datetime, timedelta
 from time import mktime
 
 
+# timestamps of aware datetimes are computed relative to EPOCH, without
+# local time lookups made by mktime
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def from_timestamp(value):
+    """ Converts unix timestamp to datetime, aware in UTC if USE_TZ is set."""
+    if value is None:
+        return None
+    if settings.USE_TZ:
+        return EPOCH + timedelta(seconds=value)
+    return datetime.fromtimestamp(value)
+
+
+def to_timestamp(value):
+    """ Converts datetime to unix timestamp.
+
+    Naive datetimes are in default time zone if USE_TZ is set and in local
+    time otherwise.
+    """
+    return to_timestamps([value])[0]
+
+
+def from_timestamps(values):
+    """ Converts sequence of unix timestamps to list of datetimes."""
+    if settings.USE_TZ:
+        return [None if v is None else EPOCH + timedelta(seconds=v)
+                for v in values]
+    fromtimestamp = datetime.fromtimestamp
+    return [None if v is None else fromtimestamp(v) for v in values]
+
+
+def to_timestamps(values):
+    """ Converts sequence of datetimes to list of unix timestamps.
+
+    Time zone settings are resolved once for the whole sequence.
+    """
+    use_tz = settings.USE_TZ
+    default_tz = timezone.get_default_timezone() if use_tz else None
+    result = []
+    append = result.append
+    for value in values:
+        if value is None or isinstance(value, (int, long, float)):
+            append(value if value is None else int(value))
+            continue
+        if not isinstance(value, datetime):
+            # date is converted as its midnight
+            value = datetime(value.year, value.month, value.day)
+        if value.tzinfo is None:
+            if not use_tz:
+                append(int(mktime(value.timetuple())))
+                continue
+            value = timezone.make_aware(value, default_tz)
+        delta = value - EPOCH
+        append(delta.days * 86400 + delta.seconds)
+    return result
+
+
+class UnixTimestampDescriptor(object):
+    """ Keeps value loaded from database as is and converts it to datetime
+    on first access."""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.field.attname]
+        if value is not None and not isinstance(value, datetime):
+            value = self.field.to_python(value)
+            obj.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.field.attname] = value
+
+
 class UnixTimestampField(models.IntegerField):
     """UnixTimestampField: creates a DateTimeField that is represented on the
     database as a TIMESTAMP field rather than the usual DATETIME field.
-    """
 
-    __metaclass__ = models.SubfieldBase
+    Timestamps are converted to datetimes lazily on attribute access, values
+    of unsaved instances are written as is if attribute wasn't accessed.
+    """
 
     def __init__(self, null=False, blank=False, **kwargs):
         super(UnixTimestampField, self).__init__(**kwargs)
@@ -20,33 +105,177 @@ class UnixTimestampField(models.IntegerField):
         # To prevent the framework from shoving in "not null".
         self.null = True
 
+    def contribute_to_class(self, cls, name):
+        super(UnixTimestampField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, UnixTimestampDescriptor(self))
+
     def to_python(self, value):
-        if isinstance(value, datetime):
+        if value is None or isinstance(value, datetime):
             return value
+        if isinstance(value, basestring):
+            if value.isdigit():
+                return from_timestamp(int(value))
+            # value serialized with value_to_string
+            result = parse_datetime(value)
+            if result is None:
+                raise ValidationError("Invalid timestamp: %r" % value)
+            if settings.USE_TZ and timezone.is_naive(result):
+                result = timezone.make_aware(
+                    result, timezone.get_default_timezone())
+            return result
+        return from_timestamp(value)
 
-        if value is None:
-            return None
-
-        return datetime.fromtimestamp(value)
+    def pre_save(self, model_instance, add):
+        # value not converted to datetime yet is saved as is
+        return model_instance.__dict__.get(self.attname)
 
     def get_prep_value(self, value):
-        if isinstance(value, (int, long)):
-            return super(UnixTimestampField, self).get_prep_value(value)
+        if isinstance(value, basestring):
+            value = self.to_python(value)
+        return to_timestamp(value)
+
+    def get_db_prep_value(self, value, *args, **kwargs):
+        return self.get_prep_value(value)
+
+    def get_db_prep_batch(self, values):
+        """ Converts values of multiple objects at once."""
+        return to_timestamps([self.to_python(v) if isinstance(v, basestring)
+                              else v for v in values])
 
-        return int(mktime(value.timetuple()))
+    def to_python_batch(self, values):
+        """ Converts timestamps loaded from database at once."""
+        return from_timestamps(values)
 
-    def _get_val_from_obj(self, obj):
-        value = super(UnixTimestampField, self)._get_val_from_obj(obj)
-        if isinstance(value, datetime):
+    def value_to_string(self, obj):
+        value = self.to_python(self._get_val_from_obj(obj))
+        return '' if value is None else value.isoformat()
+
+
+class SphinxMultiValueField(models.Field):
+    """SphinxMultiValueField: multi-valued attribute (rt_attr_multi), loaded
+    as a set of integers.
+
+    Lookups are compiled to native MVA conditions:
+        filter(tags=1) - any of values equals 1
+        filter(tags__in=[1, 2]) - any of values is in list
+        filter(tags__all=[1, 2]) - both values are present
+    """
+
+    __metaclass__ = models.SubfieldBase
+
+    description = "Sphinx multi-valued attribute"
+    empty_strings_allowed = False
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('default', set)
+        super(SphinxMultiValueField, self).__init__(**kwargs)
+
+    def to_python(self, value):
+        if isinstance(value, set):
             return value
-        try:
-            return datetime.fromtimestamp(float(value))
-        except TypeError:
-            return datetime.strptime("%Y-%m-%d %H:%M:%S", value)
+        if value is None:
+            return set()
+        if isinstance(value, basestring):
+            # SphinxQL returns MVA as comma-separated string
+            return set(int(v) for v in value.split(',') if v)
+        return set(int(v) for v in value)
 
-    def get_db_prep_value(self, value, *args, **kwargs):
+    def get_prep_value(self, value):
         if value is None:
-            return None
+            return ()
         if isinstance(value, (int, long)):
+            # single value in lookups
             return value
-        return int(mktime(value.timetuple()))
+        # MySQLdb renders tuples as (1,2,3), that is MVA syntax for REPLACE
+        return tuple(sorted(int(v) for v in value))
+
+    def get_prep_lookup(self, lookup_type, value):
+        if lookup_type in ('in', 'all', 'range'):
+            return [int(v) for v in value]
+        if lookup_type in ('exact', 'gt', 'gte', 'lt', 'lte'):
+            return int(value)
+        raise TypeError("Field has invalid lookup: %s" % lookup_type)
+
+    def get_db_prep_lookup(self, lookup_type, value, connection,
+                           prepared=False):
+        if lookup_type == 'all':
+            if not prepared:
+                value = self.get_prep_lookup(lookup_type, value)
+            return list(value)
+        return super(SphinxMultiValueField, self).get_db_prep_lookup(
+            lookup_type, value, connection, prepared=prepared)
+
+    def value_to_string(self, obj):
+        value = self._get_val_from_obj(obj)
+        return ','.join(map(str, self.get_prep_value(value)))
+
+
+class SphinxMultiValue64Field(SphinxMultiValueField):
+    """SphinxMultiValue64Field: multi-valued attribute with 64-bit values
+    (rt_attr_multi_64)."""
+
+    description = "Sphinx multi-valued attribute (64 bit)"
+
+
+class SphinxJSONField(models.Field):
+    """SphinxJSONField: JSON attribute (rt_attr_json), loaded as python object.
+
+    Lookups on JSON paths are evaluated by searchd:
+        filter(meta__rights__ru__gte=100) => meta.rights.ru >= 100
+        filter(meta__sizes__0=1) => meta.sizes[0] = 1
+        order_by('meta.popularity')
+    """
+
+    __metaclass__ = models.SubfieldBase
+
+    description = "Sphinx JSON attribute"
+    empty_strings_allowed = False
+
+    path_operators = {
+        'exact': ('=', '<>'),
+        'gt': ('>', '<='),
+        'gte': ('>=', '<'),
+        'lt': ('<', '>='),
+        'lte': ('<=', '>'),
+    }
+    path_key_re = re.compile(r'^\w+$')
+
+    def to_python(self, value):
+        if isinstance(value, basestring):
+            return json.loads(value) if value else None
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return json.dumps(value, separators=(',', ':'))
+
+    def get_path_sql(self, path):
+        """ Returns SphinxQL expression for path: meta.rights[0]."""
+        result = [self.db_column or self.attname]
+        for key in path:
+            if not self.path_key_re.match(key):
+                raise ValueError("Invalid JSON path key %r" % key)
+            result.append('[%s]' % key if key.isdigit() else '.%s' % key)
+        return ''.join(result)
+
+    def get_path_lookup(self, tokens, value, negated=False):
+        """ Compiles lookup tokens following field name to SQL condition.
+
+        Returns (sql, params) tuple.
+        """
+        tokens = list(tokens)
+        lookup_type = 'exact'
+        if tokens and (tokens[-1] in self.path_operators or tokens[-1] == 'in'):
+            lookup_type = tokens.pop()
+        if not tokens:
+            raise ValueError("Can't build correct lookup for %s without "
+                             "JSON path" % self.name)
+        path_sql = self.get_path_sql(tokens)
+        if lookup_type == 'in':
+            values = list(value)
+            sql = '%s %sIN (%s)' % (path_sql, 'NOT ' if negated else '',
+                                    ', '.join(['%s'] * len(values)))
+            return sql, values
+        operator = self.path_operators[lookup_type][int(negated)]
+        return '%s %s %%s' % (path_sql, operator), [value]
@@ -0,0 +1,258 @@
+# coding: utf-8
+""" Hedged reads to sphinx replicas.
+
+Query is executed on the primary replica in the caller thread. If it
+doesn't answer within adaptive delay (p95 of its recent latencies), the
+same compiled query is sent to the next replica by worker thread, and the
+first successful response is used. Number of hedges is limited by
+SPHINX_HEDGE_MAX_RATE share of queries, so total load stays bounded.
+
+    SPHINX_HEDGING = True
+    SPHINX_REPLICAS = {'sphinx': ['sphinx_replica']}
+
+searchd can't cancel a query over SphinxQL. When hedge wins, socket of the
+primary connection is shut down, and the connection is reopened by the next
+query. This needs driver exposing the socket (PyMySQL installed as MySQLdb),
+with other drivers hedged reads raise ImproperlyConfigured, as the caller
+would wait for the primary response anyway.
+"""
+import heapq
+import itertools
+import socket
+import threading
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from django_sphinx_db.backend import deadline as deadlines, memo as memos
+from django_sphinx_db.routers import get_replicas
+
+_pool = None
+_timer = None
+_lock = threading.Lock()
+_trackers = {}
+
+
+def get_pool():
+    """ Returns thread pool executing hedge queries."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'SPHINX_HEDGE_WORKERS', 8))
+    return _pool
+
+
+class Timer(object):
+    """ Calls functions after delay from single background thread."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def call_later(self, delay, func):
+        """ Returns handle to pass to cancel()."""
+        entry = [time.time() + delay, next(self._counter), func]
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            self._condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        entry[2] = None
+
+    def run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        entry = heapq.heappop(self._heap)
+                        break
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._condition.wait(timeout)
+            func = entry[2]
+            if func is not None:
+                func()
+
+
+def get_timer():
+    global _timer
+    with _lock:
+        if _timer is None:
+            _timer = Timer()
+    return _timer
+
+
+class Tracker(object):
+    """ Latencies of recent queries to replica and hedging counters."""
+
+    def __init__(self, window=1000, max_rate=0.05, burst=10):
+        self.latencies = deque(maxlen=window)
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = 1.0
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self._lock = threading.Lock()
+
+    def add_latency(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def get_delay(self, default, min_samples=20):
+        """ Returns p95 of recent latencies in seconds."""
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return default
+            values = sorted(self.latencies)
+        return values[int(len(values) * 0.95)]
+
+    def start_request(self):
+        with self._lock:
+            self.requests += 1
+            self.tokens = min(self.tokens + self.max_rate, self.burst)
+
+    def allow_hedge(self):
+        """ Takes hedging token, returns False if hedge rate is exceeded."""
+        with self._lock:
+            # tolerating rounding errors of accumulated rate
+            if self.tokens < 1 - 1e-9:
+                return False
+            self.tokens -= 1
+            self.fired += 1
+            return True
+
+    def hedge_won(self):
+        with self._lock:
+            self.won += 1
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'hedges_fired': self.fired,
+                    'hedges_won': self.won}
+
+
+def get_tracker(alias):
+    with _lock:
+        tracker = _trackers.get(alias)
+        if tracker is None:
+            tracker = _trackers[alias] = Tracker(
+                window=getattr(settings, 'SPHINX_HEDGE_WINDOW', 1000),
+                max_rate=getattr(settings, 'SPHINX_HEDGE_MAX_RATE', 0.05))
+    return tracker
+
+
+def get_stats():
+    """ Returns hedging counters for each primary alias."""
+    with _lock:
+        trackers = _trackers.items()
+    return dict((alias, tracker.stats()) for alias, tracker in trackers
+                if tracker.requests)
+
+
+def get_hedge_aliases(alias):
+    """ Returns replicas to hedge reads from alias, None if disabled."""
+    if not getattr(settings, 'SPHINX_HEDGING', False):
+        return None
+    return get_replicas(alias) or None
+
+
+def interrupt(connection):
+    """ Breaks waiting for response on connection, if driver exposes its
+    socket. Returns True on success."""
+    sock = getattr(connection.connection, '_sock', None)
+    if sock is None:
+        return False
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        return False
+    return True
+
+
+def execute(alias, replicas, func):
+    """ Calls func(connection) for alias connection in current thread,
+    hedging it to the first replica after adaptive delay. Returns result of
+    the first successful call."""
+    primary = connections[alias]
+    primary.ensure_connection()
+    if getattr(primary.connection, '_sock', None) is None:
+        raise ImproperlyConfigured(
+            "SPHINX_HEDGING requires database driver exposing connection "
+            "socket (PyMySQL), %s connection can't be interrupted" % alias)
+    tracker = get_tracker(alias)
+    tracker.start_request()
+    default = getattr(settings, 'SPHINX_HEDGE_DELAY', 50) / 1000.0
+    deadline = deadlines.get_deadline()
+    memo = memos.get_memo()
+    results = Queue()
+    lock = threading.Lock()
+    # 'done' is set when primary call returns, 'started' when hedge query
+    # is sent, 'interrupted' when primary socket is shut down by hedge
+    state = {'done': False, 'started': False, 'interrupted': False}
+
+    def hedge():
+        with lock:
+            if state['done'] or not tracker.allow_hedge():
+                return
+            state['started'] = True
+        started = time.time()
+        try:
+            with deadlines.activate(deadline), memos.activate(memo):
+                value = func(connections[replicas[0]])
+        except Exception as e:
+            results.put((False, e))
+            return
+        get_tracker(replicas[0]).add_latency(time.time() - started)
+        results.put((True, value))
+        with lock:
+            if not state['done']:
+                state['interrupted'] = interrupt(primary)
+
+    timer = get_timer()
+    handle = timer.call_later(tracker.get_delay(default),
+                              lambda: get_pool().apply_async(hedge))
+    started = time.time()
+    try:
+        value = func(primary)
+    except Exception as e:
+        error = e
+    else:
+        error = None
+    finally:
+        timer.cancel(handle)
+        with lock:
+            state['done'] = True
+    if state['interrupted']:
+        # socket is shut down, connection is reopened by the next query
+        try:
+            primary.close()
+        except Exception:
+            pass
+    if error is None:
+        if not state['interrupted']:
+            tracker.add_latency(time.time() - started)
+        return value
+    if not state['started']:
+        raise error
+    timeout = None
+    if deadline is not None:
+        timeout = deadline.remaining_ms() / 1000.0
+    try:
+        ok, value = results.get(timeout=timeout)
+    except Empty:
+        raise error
+    if not ok:
+        raise error
+    tracker.hedge_won()
+    return value
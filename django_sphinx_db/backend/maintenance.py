@@ -0,0 +1,104 @@
+# coding: utf-8
+""" RT index maintenance driven by SHOW INDEX STATUS.
+
+RAM chunk is flushed to disk when it grows over max_ram_chunk bytes (ram_chunk
+value of the status, ram_bytes is RAM used by the whole index and isn't
+reduced by FLUSH RTINDEX), disk chunks are merged by OPTIMIZE INDEX when there
+are more than max_disk_chunks of them or share of killed documents exceeds
+max_killed_ratio. OPTIMIZE takes precedence over FLUSH.
+
+    SPHINX_MAINTENANCE = {
+        'max_ram_chunk': 100 * 1024 * 1024,
+        'max_disk_chunks': 8,
+        'max_killed_ratio': 0.2,
+        'stagger': 600,         # seconds between OPTIMIZE commands
+        'flush_stagger': 10,    # seconds between FLUSH commands
+    }
+
+Actions are staggered across all indexes and replicas, so they never merge
+chunks at once.
+"""
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    'max_ram_chunk': 100 * 1024 * 1024,
+    'max_disk_chunks': 8,
+    'max_killed_ratio': 0.2,
+    'stagger': 600,
+    'flush_stagger': 10,
+}
+
+STATEMENTS = {
+    'flush': 'FLUSH RTINDEX %s',
+    'optimize': 'OPTIMIZE INDEX %s',
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'SPHINX_MAINTENANCE', {}))
+    return config
+
+
+def get_index_status(cursor, index_name):
+    """ Returns SHOW INDEX STATUS values, numbers converted to int."""
+    cursor.execute('SHOW INDEX %s STATUS' % index_name)
+    status = {}
+    for name, value in cursor.fetchall():
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            pass
+        status[name] = value
+    return status
+
+
+def get_killed_ratio(status):
+    """ Share of killed documents, None if searchd doesn't report it."""
+    killed = status.get('killed_documents')
+    if killed is None:
+        return None
+    total = status.get('indexed_documents', 0) + killed
+    return float(killed) / total if total else 0.0
+
+
+class Scheduler(object):
+    """ Decides which maintenance command to run for index.
+
+    One command is allowed at a time for all indexes and replicas: after
+    OPTIMIZE others wait for <stagger> seconds, after FLUSH for
+    <flush_stagger> seconds.
+    """
+
+    def __init__(self, config=None, timer=time.time):
+        self.config = config or get_config()
+        self.timer = timer
+        self.next_action = 0
+
+    def get_action(self, status):
+        """ Returns 'flush' or 'optimize' needed by index, None if it's
+        fine."""
+        config = self.config
+        killed_ratio = get_killed_ratio(status)
+        if (status.get('disk_chunks', 0) > config['max_disk_chunks'] or
+                (killed_ratio or 0) > config['max_killed_ratio']):
+            return 'optimize'
+        if status.get('ram_chunk', 0) > config['max_ram_chunk']:
+            return 'flush'
+        return None
+
+    def schedule(self, status):
+        """ Returns action to run now, None if not needed or postponed."""
+        action = self.get_action(status)
+        if action is None:
+            return None
+        now = self.timer()
+        if now < self.next_action:
+            return None
+        if action == 'optimize':
+            self.next_action = now + self.config['stagger']
+        else:
+            self.next_action = now + self.config['flush_stagger']
+        return action
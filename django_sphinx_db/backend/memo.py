@@ -0,0 +1,114 @@
+# coding: utf-8
+""" Request-scoped memoization of search query results.
+
+Pages often evaluate the same queryset several times (tag clouds, related
+blocks in templates). Inside query_memo() block or a request processed by
+QueryMemoMiddleware identical queries are sent to searchd once, memo is
+cleared by any write through sphinx compilers.
+"""
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class QueryMemo(object):
+    """ Query results keyed by compiled SphinxQL and params.
+
+    Concurrent calls with the same key wait for the first one and share
+    its result.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, func):
+        """ Returns memoized result for key, calling func to compute it."""
+        while True:
+            with self._lock:
+                if key in self._results:
+                    return self._results[key]
+                event = self._pending.get(key)
+                owner = event is None
+                if owner:
+                    event = self._pending[key] = threading.Event()
+            if owner:
+                break
+            # result is ready, or first call failed and is retried
+            event.wait()
+        try:
+            value = func()
+        except Exception:
+            with self._lock:
+                if self._pending.get(key) is event:
+                    del self._pending[key]
+            event.set()
+            raise
+        with self._lock:
+            # result of query started before invalidation is not kept
+            if self._pending.get(key) is event:
+                del self._pending[key]
+                self._results[key] = value
+        event.set()
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._results.clear()
+            self._pending.clear()
+
+    def __len__(self):
+        return len(self._results)
+
+
+def get_memo():
+    """ Returns memo active in current thread or None."""
+    return getattr(_local, 'memo', None)
+
+
+def invalidate_memo():
+    memo = get_memo()
+    if memo is not None:
+        memo.invalidate()
+
+
+@contextmanager
+def activate(memo):
+    """ Makes memo active in current thread, i.e. in worker thread serving
+    the same request."""
+    previous = get_memo()
+    _local.memo = memo
+    try:
+        yield memo
+    finally:
+        _local.memo = previous
+
+
+@contextmanager
+def query_memo():
+    """ Memoizes results of identical queries executed in block.
+
+    Nested blocks share memo of the outermost one.
+    """
+    memo = get_memo()
+    if memo is not None:
+        yield memo
+        return
+    with activate(QueryMemo()) as memo:
+        yield memo
+
+
+class QueryMemoMiddleware(object):
+    """ Memoizes results of identical queries during request processing."""
+
+    def process_request(self, request):
+        _local.memo = QueryMemo()
+
+    def process_response(self, request, response):
+        _local.memo = None
+        return response
+
+    def process_exception(self, request, exception):
+        _local.memo = None
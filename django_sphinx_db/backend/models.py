@@ -1,23 +1,48 @@
 # coding: utf-8
 
 from MySQLdb import OperationalError
-import re
 from django.conf import settings
 from django.db import models, connections, connection
 from django.db.models.sql import Query, AND
+from django.db.models.sql.constants import SINGLE, MULTI, QUERY_TERMS
 from django.db.models.query import QuerySet
+from django.utils.datastructures import SortedDict
 from django.utils.log import getLogger
 from django_sphinx_db.backend.sphinx.compiler import SphinxWhereNode, SphinxExtraWhere, SphinxQLCompiler, DJANGO17
 from django_sphinx_db.backend.sphinx import aggregates as sphinx_aggregates
+from django_sphinx_db.backend.sphinx.expressions import Expr
+from django_sphinx_db.backend.sphinx.match import (
+    sphinx_escape, Match, Phrase, Or, Not, parse_lookup, parse_expression)
+from django_sphinx_db.backend.fields import SphinxJSONField
+from django_sphinx_db.backend.cache import LRUCache
+from django_sphinx_db.backend import chunks, arrays, rows, sharding
+from django_sphinx_db.backend.cost import check_query
 import django
 
 
-def sphinx_escape(value):
-    if type(value) not in (str, unicode):
-        return value
-    value = re.sub(r"([=<>()|!@~&/^$\-\'\"\\])", r'\\\1', value)
-    value = re.sub(r'(SENTENCE|PARAGRAPH)', r'\\\1', value, flags=re.I)
-    return value
+def show_meta(using):
+    """ Returns SHOW META result for last query executed on connection."""
+    c = connections[using].cursor()
+    try:
+        c.execute("SHOW META")
+        return dict(c.fetchall())
+    except UnicodeDecodeError:
+        return {}
+    finally:
+        c.close()
+
+
+_suggest_cache = None
+
+
+def get_suggest_cache():
+    """ Returns cache for CALL KEYWORDS and CALL SUGGEST results."""
+    global _suggest_cache
+    if _suggest_cache is None:
+        _suggest_cache = LRUCache(
+            maxsize=getattr(settings, 'SPHINX_SUGGEST_CACHE_SIZE', 1000),
+            ttl=getattr(settings, 'SPHINX_SUGGEST_CACHE_TTL', 60))
+    return _suggest_cache
 
 
 def immortal_generator(func):
@@ -52,10 +77,13 @@ def immortal_generator(func):
 
 class SphinxQuery(Query):
     _clonable = ('options', 'match', 'group_limit', 'group_order_by',
-                 'with_meta')
+                 'with_meta', 'cutoff', 'facets', 'cost_checked')
 
     aggregates_module = sphinx_aggregates
 
+    # 'all' lookup is supported for multi-valued attributes
+    query_terms = QUERY_TERMS | set(['all'])
+
     def __init__(self, *args, **kwargs):
         kwargs.setdefault('where', SphinxWhereNode)
         super(SphinxQuery, self).__init__(*args, **kwargs)
@@ -65,9 +93,48 @@ class SphinxQuery(Query):
         for attr_name in self._clonable:
             value = getattr(self, attr_name, None)
             if value:
+                if hasattr(value, 'clone'):
+                    value = value.clone()
                 setattr(query, attr_name, value)
         return query
 
+    def get_count(self, using):
+        """ Takes number of matches from SHOW META instead of COUNT(*) query.
+
+        Limited count also stops searchd after <high_mark> matches found.
+        """
+        obj = self.clone()
+        obj.facets = None
+        obj.clear_ordering(True)
+        obj.clear_limits()
+        obj.set_limits(high=1)
+        if self.high_mark is not None:
+            obj.cutoff = self.high_mark
+        obj.with_meta = True
+        obj.meta_results = None
+        obj.get_compiler(using=using).execute_sql(SINGLE)
+        # empty result ({}) is set if query wasn't sent to searchd
+        meta = getattr(obj, 'meta_results', None)
+        if meta is None:
+            meta = show_meta(using)
+        return self.count_from_meta(meta)
+
+    def count_from_meta(self, meta):
+        """ Applies query limits to total_found value from SHOW META."""
+        number = max(0, int(meta.get('total_found', 0)) - self.low_mark)
+        if self.high_mark is not None:
+            number = min(number, self.high_mark - self.low_mark)
+        return number
+
+    def has_results(self, using):
+        """ Existence check doesn't need more than one match."""
+        obj = self.clone()
+        obj.facets = None
+        obj.clear_ordering(True)
+        obj.set_limits(high=1)
+        obj.cutoff = obj.high_mark
+        return bool(obj.get_compiler(using=using).execute_sql(SINGLE))
+
     def __str__(self):
         def to_str(text):
             if type(text) is unicode:
@@ -103,7 +170,12 @@ class SphinxQuerySet(QuerySet):
         # This is the right thing to do in cases of master/slave or sharding
         # but with Sphinx, we want all related queries to flow to Sphinx,
         # never another configured database.
-        return self._clone()
+        clone = self._clone()
+        # shards of sharded model are kept, i.e. for Model.save()
+        policy = sharding.get_policy(self.model)
+        if policy is not None and alias in policy.aliases:
+            clone._db = alias
+        return clone
 
     def with_meta(self):
         """ Allows to execute SHOW META immediately after main query."""
@@ -111,58 +183,54 @@ class SphinxQuerySet(QuerySet):
         setattr(clone.query, 'with_meta', True)
         return clone
 
-    def _negate_expression(self, negate, lookup):
-        if isinstance(lookup, (tuple, list)):
-            result = []
-            for v in lookup:
-                result.append(self._negate_expression(negate, v))
-            return result
-        else:
-            if not isinstance(lookup, (str, unicode)):
-                lookup = unicode(lookup)
-
-            if not lookup.startswith('"'):
-                lookup = '"%s"' % lookup
-            if negate:
-                lookup = '-%s' % lookup
-            return lookup
-
-
     def _filter_or_exclude(self, negate, *args, **kwargs):
         """ String attributes can't be compared with = term, so they are
         replaced with MATCH('@field_name "value"')."""
-        match_kwargs = {}
+        match_nodes = []
+        json_sqls, json_params = [], []
         for lookup, value in kwargs.items():
             try:
                 tokens = lookup.split('__')
                 field_name = tokens[0]
+                if lookup == 'pk':
+                    field = self.model._meta.pk
+                else:
+                    field = self.model._meta.get_field(field_name)
+                if isinstance(field, SphinxJSONField):
+                    sql, params = field.get_path_lookup(tokens[1:], value,
+                                                        negated=negate)
+                    json_sqls.append(sql)
+                    json_params.extend(params)
+                    del kwargs[lookup]
+                    continue
                 lookup_type = None
                 if len(tokens) == 2:
                     lookup_type = tokens[1]
                 elif len(tokens) > 2:
                     raise ValueError("Can't build correct lookup for %s" % lookup)
-                if lookup == 'pk':
-                    field = self.model._meta.pk
-                else:
-                    field = self.model._meta.get_field(field_name)
                 if isinstance(field, models.CharField):
                     if lookup_type and lookup_type not in ('in', 'exact', 'startswith'):
                         raise ValueError("Can't build correct lookup for %s" % lookup)
-                    if lookup_type == 'startswith':
-                        value = value + '*'
-                    field_name = field.attname
-                    match_kwargs.setdefault(field_name, set())
-                    sphinx_lookup = sphinx_escape(value)
-                    sphinx_expr = self._negate_expression(negate, sphinx_lookup)
-                    if isinstance(sphinx_expr, list):
-                        match_kwargs[field_name].update(sphinx_expr)
+                    if lookup_type == 'in':
+                        node = Or(*[Phrase(v) for v in value])
                     else:
-                        match_kwargs[field_name].add(sphinx_expr)
+                        node = Phrase(value, prefix=lookup_type == 'startswith')
+                    if negate:
+                        node = Not(node)
+                    match_nodes.append((field.attname, node))
                     del kwargs[lookup]
             except models.FieldDoesNotExist:
                 continue
-        if match_kwargs:
-            return self.match(**match_kwargs)._filter_or_exclude(negate, *args, **kwargs)
+        qs = self
+        if json_sqls:
+            qs = qs._clone()
+            qs.query.where.add(SphinxExtraWhere(json_sqls, json_params), AND)
+        if match_nodes:
+            if qs is self:
+                qs = qs._clone()
+            qs._add_match(match_nodes)
+        if qs is not self:
+            return qs._filter_or_exclude(negate, *args, **kwargs)
         return super(SphinxQuerySet, self)._filter_or_exclude(negate, *args, **kwargs)
 
     def get(self, *args, **kwargs):
@@ -177,25 +245,47 @@ class SphinxQuerySet(QuerySet):
 
         qs.match(field1='sphinx_loopup1',field2='sphinx_loopup2')
             compiles to
-        MATCH('@field1 sphinx_lookup1 @field2 sphinx_lookup2')
+        MATCH('@field1 ("sphinx_lookup1") @field2 ("sphinx_lookup2")')
+
+        Expressions may also be trees of match nodes:
+        qs.match(Term('cat') | Phrase('funny dog'), title=~Term('fake'))
         """
+        nodes = [('*', parse_expression(e)) for e in args]
+        nodes.extend((field, parse_lookup(lookup))
+                     for field, lookup in kwargs.items())
         qs = self._clone()
-        if not hasattr(qs.query, 'match'):
-            qs.query.match = dict()
-        for expression in args:
-            qs.query.match.setdefault('*', set())
-            if isinstance(expression, (list, tuple)):
-                qs.query.match['*'].update(expression)
-            else:
-                qs.query.match['*'].add(expression)
-        for field, expression in kwargs.items():
-            qs.query.match.setdefault(field, set())
-            if isinstance(expression, (list, tuple, set)):
-                qs.query.match[field].update(expression)
-            else:
-                qs.query.match[field].add(expression)
+        qs._add_match(nodes)
         return qs
 
+    def annotate(self, *args, **kwargs):
+        """ Adds sphinx expressions (Weight(), Expr()) to select list.
+
+        qs.annotate(rank=Weight() + Expr('LN(views)')).order_by('-rank')
+
+        Values are available as model instance attributes. Aggregates are
+        passed to default annotate implementation.
+        """
+        select = SortedDict()
+        for alias, expression in kwargs.items():
+            if isinstance(expression, Expr):
+                select[alias] = expression.as_sql()
+                del kwargs[alias]
+        qs = self
+        if select:
+            qs = qs.extra(select=select)
+        if args or kwargs:
+            return super(SphinxQuerySet, qs).annotate(*args, **kwargs)
+        return qs._clone()
+
+    def _add_match(self, nodes):
+        """ Adds (field_name, node) pairs to MATCH expression of self."""
+        match = getattr(self.query, 'match', None)
+        # match is cloned with query, so it can be modified in place
+        if not isinstance(match, Match):
+            match = self.query.match = Match()
+        for field_name, node in nodes:
+            match.add(node, field_name)
+
     def notequal(self, **kw):
         """ Support for <> term, NOT(@id=value) doesn't work."""
         qs = self._clone()
@@ -244,26 +334,424 @@ class SphinxQuerySet(QuerySet):
         qs.query.group_order_by = group_order_by
         return qs
 
+    def facet(self, *args, **kw):
+        """ Adds FACET clauses to query.
+
+        *args: field names, aliases from extra_select or sphinx expressions
+        keyword order_by: (FACET <expr> ORDER BY)
+            string list, sets sort order of facet values, 'count' stands for
+            COUNT(*), in example: order_by=('-count',)
+        keyword limit: (FACET <expr> LIMIT <N>)
+            int, limits number of facet values to N
+
+        After evaluation facet counts are available as qs.facets:
+        {facet_name: {value: count}}
+        """
+        order_by = kw.get('order_by', ())
+        limit = kw.get('limit', 0)
+        qs = self._clone()
+        qs.query.facets = list(getattr(qs.query, 'facets', None) or [])
+        for name in args:
+            if name in qs.query.extra_select:
+                expression = name
+            else:
+                try:
+                    field = self.model._meta.get_field_by_name(name)[0]
+                    expression = field.column
+                except models.FieldDoesNotExist:
+                    expression = name
+            qs.query.facets.append((name, expression, order_by, limit))
+        return qs
+
+    def near(self, lat_field, lon_field, point, radius=None, **kw):
+        """ Adds GEODIST() distance in meters to point as select expression.
+
+        point: (latitude, longitude) in units of lat/lon attributes
+        radius: filters out documents farther than radius meters
+        keyword degrees: True if attributes are stored in degrees instead
+            of radians
+        keyword alias: name of distance attribute, 'distance' by default
+
+        Results are ordered by distance before existing ordering.
+        """
+        alias = kw.get('alias', 'distance')
+        opts = self.model._meta
+        lat, lon = [float(value) for value in point]
+        expression = 'GEODIST(%s, %s, %r, %r%s)' % (
+            opts.get_field(lat_field).column, opts.get_field(lon_field).column,
+            lat, lon, ', {in=degrees}' if kw.get('degrees') else '')
+        qs = self.extra(select={alias: expression})
+        if radius is not None:
+            qs.query.where.add(SphinxExtraWhere(
+                ['%s <= %r' % (alias, float(radius))], []), AND)
+        return qs.order_by(alias, *qs.query.order_by)
+
+    def snippets(self, docs, query=None, index=None, **opts):
+        """ Builds excerpts for documents with single CALL SNIPPETS query.
+
+        docs: list of document texts
+        query: keywords to highlight, MATCH expression of queryset by default
+            (passed with query_mode=1 to be parsed with its operators)
+        index: index used for text processing, model index by default
+        **opts: CALL SNIPPETS options, i.e. limit=200, around=5
+
+        Returns list of snippets in order of docs.
+        """
+        docs = list(docs)
+        if not docs:
+            return []
+        if query is None:
+            compiler = self.query.get_compiler(using=self.db)
+            query = compiler.get_match_expression()
+            if query is None:
+                raise ValueError("No query for snippets")
+            opts.setdefault('query_mode', True)
+        index = index or self.model._meta.db_table
+        sql = ['CALL SNIPPETS((%s), %%s, %%s' % ', '.join(['%s'] * len(docs))]
+        params = docs + [index, query]
+        for name, value in sorted(opts.items()):
+            sql.append('%%s AS %s' % name)
+            params.append(int(value) if isinstance(value, bool) else value)
+        c = connections[self.db].cursor()
+        try:
+            c.execute(', '.join(sql) + ')', params)
+            return [row[0] for row in c.fetchall()]
+        finally:
+            c.close()
+
+    def keywords(self, text, hits=False):
+        """ Tokenizes text with CALL KEYWORDS.
+
+        Returns list of dicts with keys qpos, tokenized, normalized
+        and also docs, hits if hits=True.
+        """
+        args = (1,) if hits else ()
+        return self._call_cached('KEYWORDS', text, args, {})
+
+    def suggest(self, word, **opts):
+        """ Returns corrections for word with CALL SUGGEST.
+
+        **opts: CALL SUGGEST options, i.e. limit=5, max_edits=2
+        Returns list of dicts with keys suggest, distance, docs.
+        """
+        return self._call_cached('SUGGEST', word, (), opts)
+
+    def qsuggest(self, query, **opts):
+        """ Returns corrections for last word of query with CALL QSUGGEST."""
+        return self._call_cached('QSUGGEST', query, (), opts)
+
+    def _call_cached(self, procedure, text, args, opts):
+        """ Executes CALL <procedure>(text, index, *args, *opts).
+
+        Results are cached in process by index and normalized text.
+        """
+        if isinstance(text, str):
+            text = text.decode('utf-8')
+        text = u' '.join(text.lower().split())
+        index = self.model._meta.db_table
+        key = (procedure, index, text) + tuple(args) + tuple(
+            sorted(opts.items()))
+        cache = get_suggest_cache()
+        result = cache.get(key)
+        if result is None:
+            sql = ['%s', '%s'] + ['%s'] * len(args)
+            params = [text, index] + list(args)
+            for name, value in sorted(opts.items()):
+                sql.append('%%s AS %s' % name)
+                params.append(value)
+            c = connections[self.db].cursor()
+            try:
+                c.execute('CALL %s(%s)' % (procedure, ', '.join(sql)), params)
+                names = [d[0] for d in c.description]
+                result = [dict(zip(names, row)) for row in c.fetchall()]
+            finally:
+                c.close()
+            cache.set(key, result)
+        return list(result)
+
     def _clone(self, klass=None, setup=False, **kwargs):
         """ Add support of cloning self.query.options."""
         result = super(SphinxQuerySet, self)._clone(klass, setup, **kwargs)
 
         return result
 
+    def count(self):
+        """ Counts matches without extra COUNT(*) query.
+
+        total_found is taken from already fetched SHOW META result if any,
+        otherwise LIMIT 1 query is executed followed by SHOW META.
+        """
+        meta = getattr(self, 'meta', None)
+        if meta and 'total_found' in meta:
+            return self.query.count_from_meta(meta)
+        if self._result_cache is not None and self.query.high_mark is not None:
+            return len(self._result_cache)
+        chunk_querysets = self._get_chunk_querysets(with_limits=False)
+        if chunk_querysets:
+            counts = chunks.map_in_pool(lambda qs: qs.count(),
+                                        chunk_querysets)
+            return self.query.count_from_meta({'total_found': sum(counts)})
+        return self.query.get_count(using=self.db)
+
+    def exists(self):
+        if self._result_cache is None:
+            chunk_querysets = self._get_chunk_querysets(with_limits=False)
+            if chunk_querysets:
+                return any(chunks.map_in_pool(lambda qs: qs.exists(),
+                                              chunk_querysets))
+        return super(SphinxQuerySet, self).exists()
+
+    def _get_shard_querysets(self):
+        """ Returns querysets bound to shards owning rows matched by self.
+
+        Returns None for models without SPHINX_SHARDS policy. Rows are
+        grouped by shard key lookup, without it all shards are affected.
+        """
+        policy = sharding.get_policy(self.model)
+        if policy is None:
+            return None
+        field = policy.get_key_field(self.model)
+        found = sharding.find_key_lookup(self.query.where, field)
+        if found is None:
+            groups = SortedDict((alias, None) for alias in policy.aliases)
+        else:
+            index, (constraint, lookup_type, value_annot, value) = found
+            if lookup_type == 'exact':
+                groups = {policy.get_alias(value): None}
+            else:
+                groups = policy.group_values(value)
+        result = []
+        for alias, values in groups.items():
+            qs = self._clone()
+            if values is not None:
+                qs.query.where.children[index] = (
+                    constraint, lookup_type, value_annot, values)
+            qs._db = alias
+            result.append(qs)
+        return result
+
+    def _map_shards(self, func, items):
+        """ Applies func to items concurrently if there are several ones."""
+        if len(items) == 1:
+            return [func(items[0])]
+        return chunks.map_in_pool(func, items)
+
+    def update(self, **kwargs):
+        querysets = self._get_shard_querysets()
+        if querysets is None:
+            return super(SphinxQuerySet, self).update(**kwargs)
+        return sum(self._map_shards(
+            lambda qs: super(SphinxQuerySet, qs).update(**kwargs),
+            querysets))
+
+    def delete(self):
+        querysets = self._get_shard_querysets()
+        if querysets is None:
+            return super(SphinxQuerySet, self).delete()
+        self._map_shards(lambda qs: super(SphinxQuerySet, qs).delete(),
+                         querysets)
+        self._result_cache = None
+
+    def create(self, **kwargs):
+        if sharding.get_policy(self.model) is None:
+            return super(SphinxQuerySet, self).create(**kwargs)
+        # alias is chosen by router for the instance
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+    def bulk_create(self, objs, batch_size=None):
+        """ Sends objects of sharded models to their shards concurrently."""
+        policy = sharding.get_policy(self.model)
+        if policy is None:
+            return super(SphinxQuerySet, self).bulk_create(objs, batch_size)
+        objs = list(objs)
+
+        def create(item):
+            alias, group = item
+            if alias is None:
+                raise ValueError("Shard key of %s is not set"
+                                 % self.model.__name__)
+            qs = self._clone()
+            qs._db = alias
+            return super(SphinxQuerySet, qs).bulk_create(group, batch_size)
+        self._map_shards(create, policy.group_instances(objs).items())
+        return objs
+
+    def _get_chunk_querysets(self, with_limits=True):
+        """ Splits query with huge IN lookup into chunk querysets.
+
+        Returns None if there is no IN lookup longer than SPHINX_IN_CHUNK_SIZE.
+        Rows of chunks can be merged only by explicit ordering reproducible
+        in python, otherwise (with_limits=True) single query is executed.
+        """
+        chunk_size = chunks.get_chunk_size()
+        if not chunks.find_in_lookup(self.query.where, chunk_size):
+            return None
+        if with_limits and not self._get_chunk_ordering():
+            return None
+        # cost is checked once for the whole IN list, not for each chunk
+        check_query(self.query)
+        # removing IN lookup from cloned where tree
+        base = self._clone()
+        node, child = chunks.find_in_lookup(base.query.where, chunk_size)
+        node.children.remove(child)
+        constraint, lookup_type, value_annot, values = child
+        base.query.facets = None
+        base.query.cost_checked = True
+        base.query.clear_limits()
+        high_mark = self.query.high_mark if with_limits else None
+        result = []
+        for chunk in chunks.split_values(values, chunk_size):
+            sql, params = chunks.chunk_condition(constraint.col, chunk)
+            qs = base._clone()
+            qs.query.where.add(SphinxExtraWhere([sql], params), AND)
+            limit = chunks.chunk_length(chunk)
+            if high_mark is not None:
+                limit = min(limit, high_mark)
+            qs.query.set_limits(high=limit)
+            result.append(qs)
+        return result
+
+    def _get_chunk_ordering(self):
+        """ Returns list of (attname, descending) for merging chunk results.
+
+        Returns None if ordering can't be reproduced in python.
+        """
+        ordering = self.query.order_by or (
+            self.query.default_ordering and self.model._meta.ordering) or ()
+        result = []
+        for name in ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-+')
+            if name in self.query.extra_select:
+                result.append((name, descending))
+                continue
+            try:
+                if name == 'pk':
+                    field = self.model._meta.pk
+                else:
+                    field = self.model._meta.get_field(name)
+            except models.FieldDoesNotExist:
+                return None
+            result.append((field.attname, descending))
+        return result
+
+    def _chunked_iterator(self, chunk_querysets):
+        """ Evaluates chunk querysets concurrently and merges results."""
+        results = chunks.map_in_pool(
+            lambda qs: (list(qs), getattr(qs, 'meta', {})), chunk_querysets)
+        rows = [row for chunk_rows, meta in results for row in chunk_rows]
+        ordering = self._get_chunk_ordering()
+        if ordering:
+            chunks.sort_rows(rows, ordering)
+        rows = rows[self.query.low_mark:self.query.high_mark]
+        if getattr(self.query, 'with_meta', False):
+            total_found = sum(int(meta.get('total_found', 0))
+                              for chunk_rows, meta in results)
+            self.meta = {'total': str(len(rows)),
+                         'total_found': str(total_found)}
+        return rows
+
+    def stream(self, chunk_size=1000, tuples=False):
+        """ Iterates over results without buffering whole result set.
+
+        Rows are read by chunk_size from unbuffered server-side cursor, so
+        peak memory doesn't depend on result size. Results are not cached.
+        tuples=True yields raw row tuples instead of model instances.
+        With with_meta() SHOW META is fetched after the last row is read.
+        Connection is busy until the stream is exhausted or closed, other
+        queries on it fail meanwhile.
+        """
+        qs = self._clone()
+        qs.query.stream_chunk_size = chunk_size
+        qs.query.facets = None
+        if tuples:
+            rows = qs.query.get_compiler(using=qs.db).results_iter()
+        else:
+            rows = qs.iterator()
+        for row in rows:
+            yield row
+        if getattr(qs.query, 'with_meta', False):
+            if tuples:
+                qs._fetch_meta()
+            self.meta = qs.meta
+
+    def rows(self, *fields):
+        """ Returns list of lightweight rows instead of model instances.
+
+        Rows are namedtuples with selected fields, annotate() aliases and
+        aggregates as attributes, in the order of given fields like in
+        values_list(); field values are converted like model instance
+        attributes. Without fields all attributes are selected, full-text
+        fields are not returned by searchd.
+        """
+        if not fields:
+            fields = [f.name for f in self.model._meta.concrete_fields
+                      if not isinstance(f, SphinxField)]
+            fields += (list(self.query.extra_select) +
+                       list(self.query.aggregate_select))
+        qs = self.values_list(*fields)
+        names = (list(qs.query.extra_select) + list(qs.field_names) +
+                 list(qs.query.aggregate_select))
+        results = qs.query.get_compiler(using=qs.db).results_iter()
+        order = list(fields) + [n for n in names if n not in fields]
+        if order != names:
+            # columns are selected as extra, fields, aggregates
+            indexes = [names.index(name) for name in order]
+            results = (tuple(row[i] for i in indexes) for row in results)
+            names = order
+        result = rows.make_rows(self.model, names, results)
+        if getattr(qs.query, 'with_meta', False):
+            # SHOW META is read along with query of values_list() clone
+            meta = getattr(qs.query, 'meta_results', None)
+            if meta is None:
+                meta = show_meta(settings.SPHINX_DATABASE_NAME)
+            self.meta = meta
+        return result
+
+    def to_arrays(self, *fields, **kwargs):
+        """ Returns dict of NumPy arrays with values of given fields.
+
+        Rows are read by chunk_size from unbuffered cursor and written to
+        preallocated typed arrays, dtypes are inferred from field classes.
+        Without fields all numeric attributes of the model are exported.
+        """
+        chunk_size = kwargs.pop('chunk_size', 1000)
+        opts = self.model._meta
+        if not fields:
+            fields = [f.name for f in opts.fields if arrays.is_exportable(f)]
+        model_fields = [opts.pk if name == 'pk' else opts.get_field(name)
+                        for name in fields]
+        dtypes = [arrays.get_dtypes(f) for f in model_fields]
+        qs = self.values_list(*fields)
+        qs.query.stream_chunk_size = chunk_size
+        qs.query.facets = None
+        capacity = None
+        if qs.query.high_mark is not None:
+            capacity = qs.query.high_mark - qs.query.low_mark
+        rows = qs.query.get_compiler(using=qs.db).execute_sql(MULTI)
+        columns = arrays.fill_arrays(rows, dtypes, capacity)
+        return SortedDict(zip(fields, columns))
+
     def _fetch_meta(self):
-        c = connections[settings.SPHINX_DATABASE_NAME].cursor()
-        try:
-            c.execute("SHOW META")
-            self.meta = dict([c.fetchone()])
-        except UnicodeDecodeError:
-            self.meta = {}
-        finally:
-            c.close()
+        # SHOW META is read along with memoized query results
+        meta = getattr(self.query, 'meta_results', None)
+        if meta is None:
+            meta = show_meta(settings.SPHINX_DATABASE_NAME)
+        self.meta = meta
 
     @immortal_generator
     def iterator(self):
+        chunk_querysets = self._get_chunk_querysets()
+        if chunk_querysets:
+            for row in self._chunked_iterator(chunk_querysets):
+                yield row
+            return
         for row in super(SphinxQuerySet, self).iterator():
             yield row
+        if getattr(self.query, 'facets', None):
+            self.facets = getattr(self.query, 'facet_results', {})
         if getattr(self.query, 'with_meta', False):
             self._fetch_meta()
 
@@ -286,8 +774,8 @@ class SphinxManager(models.Manager):
     def options(self, **kw):
         return self.get_query_set().options(**kw)
 
-    def match(self, expression):
-        return self.get_query_set().match(expression)
+    def match(self, *args, **kw):
+        return self.get_query_set().match(*args, **kw)
 
     def notequal(self, **kw):
         return self.get_query_set().notequal(**kw)
@@ -295,6 +783,31 @@ class SphinxManager(models.Manager):
     def group_by(self, *args, **kw):
         return self.get_query_set().group_by(*args, **kw)
 
+    def facet(self, *args, **kw):
+        return self.get_query_set().facet(*args, **kw)
+
+    def near(self, lat_field, lon_field, point, radius=None, **kw):
+        return self.get_query_set().near(lat_field, lon_field, point,
+                                         radius, **kw)
+
+    def snippets(self, docs, query=None, index=None, **opts):
+        return self.get_query_set().snippets(docs, query, index, **opts)
+
+    def keywords(self, text, hits=False):
+        return self.get_query_set().keywords(text, hits)
+
+    def suggest(self, word, **opts):
+        return self.get_query_set().suggest(word, **opts)
+
+    def qsuggest(self, query, **opts):
+        return self.get_query_set().qsuggest(query, **opts)
+
+    def rows(self, *fields):
+        return self.get_query_set().rows(*fields)
+
+    def to_arrays(self, *fields, **kw):
+        return self.get_query_set().to_arrays(*fields, **kw)
+
     def get(self, *args, **kw):
         return self.get_query_set().get(*args, **kw)
 
@@ -0,0 +1,109 @@
+# coding: utf-8
+""" Sampling of executed search queries for cache warm-up.
+
+    SPHINX_QUERY_RECORDER = {
+        'path': '/var/tmp/sphinx_queries.log',
+        'sample_rate': 0.01,
+        'flush_interval': 60,
+    }
+
+Sampled statements are counted in memory and appended to file as JSON lines
+{"sql": ..., "params": [...], "count": N} every flush_interval seconds, so
+several processes may share one file. warm_sphinx command replays the most
+frequent queries.
+"""
+import atexit
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+_recorder = None
+_lock = threading.Lock()
+
+
+class QueryRecorder(object):
+    """ Counts sampled statements and flushes counters to file."""
+
+    def __init__(self, path, sample_rate=0.01, flush_interval=60,
+                 random=random.random, timer=time.time):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.random = random
+        self.timer = timer
+        self.next_flush = timer() + flush_interval
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """ Returns True if query should be recorded."""
+        return self.random() < self.sample_rate
+
+    def record(self, sql, params):
+        key = (sql, json.dumps(list(params), default=unicode))
+        with self._lock:
+            self._counts[key] += 1
+        if self.timer() >= self.next_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(int)
+            self.next_flush = self.timer() + self.flush_interval
+        if not counts:
+            return
+        lines = []
+        for (sql, params), count in counts.items():
+            lines.append('{"sql": %s, "params": %s, "count": %d}\n' % (
+                json.dumps(sql), params, count))
+        with open(self.path, 'a') as f:
+            f.write(''.join(lines))
+
+
+def get_recorder():
+    """ Returns recorder configured with SPHINX_QUERY_RECORDER or None."""
+    global _recorder
+    config = getattr(settings, 'SPHINX_QUERY_RECORDER', None)
+    if not config:
+        return None
+    with _lock:
+        if _recorder is None:
+            _recorder = QueryRecorder(**config)
+            atexit.register(_recorder.flush)
+    return _recorder
+
+
+def read_queries(path):
+    """ Returns {(sql, params): count} aggregated from recorder file."""
+    counts = defaultdict(int)
+    with open(path) as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # line may be truncated by killed process
+                continue
+            params = tuple(tuple(p) if isinstance(p, list) else p
+                           for p in item['params'])
+            counts[item['sql'], params] += item['count']
+    return counts
+
+
+def top_queries(counts, limit, variants=1):
+    """ Returns most frequent queries of <limit> most frequent statement
+    shapes (SQL without params), up to <variants> params for each shape."""
+    shapes = defaultdict(list)
+    for (sql, params), count in counts.items():
+        shapes[sql].append((count, params))
+    totals = sorted(shapes.items(),
+                    key=lambda item: -sum(c for c, p in item[1]))
+    result = []
+    for sql, items in totals[:limit]:
+        items.sort(key=lambda item: -item[0])
+        for count, params in items[:variants]:
+            result.append((sql, params))
+    return result
@@ -0,0 +1,60 @@
+# coding: utf-8
+""" Lightweight result rows.
+
+Rows are namedtuples generated for each set of selected columns, so they
+have attribute access of model instances at the cost and memory of tuples.
+"""
+import threading
+from collections import namedtuple
+
+from django.db import models
+from django.db.models.fields.subclassing import Creator
+
+from django_sphinx_db.backend.fields import UnixTimestampDescriptor
+
+_classes = {}
+_lock = threading.Lock()
+
+
+def get_row_class(model, names):
+    """ Returns namedtuple class with given attribute names."""
+    key = (model, tuple(names))
+    with _lock:
+        cls = _classes.get(key)
+        if cls is None:
+            cls = namedtuple('%sRow' % model.__name__, names)
+            _classes[key] = cls
+    return cls
+
+
+def get_converter(model, name):
+    """ Returns function converting list of database values of model
+    attribute the same way model instance does, None if values are used as
+    is."""
+    try:
+        field = model._meta.get_field(name)
+    except models.FieldDoesNotExist:
+        return None
+    descriptor = model.__dict__.get(field.attname)
+    if isinstance(descriptor, UnixTimestampDescriptor):
+        return field.to_python_batch
+    if isinstance(descriptor, Creator):
+        to_python = field.to_python
+        return lambda values: [to_python(v) for v in values]
+    return None
+
+
+def make_rows(model, names, results):
+    """ Converts iterable of database rows to list of namedtuples."""
+    cls = get_row_class(model, names)
+    make = cls._make
+    converters = [(i, c) for i, c in enumerate(
+        get_converter(model, name) for name in names) if c is not None]
+    if not converters:
+        return [make(row) for row in results]
+    rows = [list(row) for row in results]
+    # values are converted by columns
+    for i, convert in converters:
+        for row, value in zip(rows, convert([row[i] for row in rows])):
+            row[i] = value
+    return [make(row) for row in rows]
@@ -0,0 +1,126 @@
+# coding: utf-8
+""" Routing writes of RT indexes split across several searchd nodes.
+
+    SPHINX_SHARDS = {
+        'myapp.MyIndex': {
+            'aliases': ['sphinx1', 'sphinx2'],
+            'key': 'pk',            # shard key field, pk by default
+            'function': 'hash',     # 'hash', 'range' or callable
+            'ranges': [1000000],    # upper bounds of shards for 'range'
+        },
+    }
+
+Custom function (or its dotted path) is called with key value and list of
+aliases and returns alias owning the value.
+"""
+import zlib
+from bisect import bisect_right
+
+from django.conf import settings
+from django.db.models.sql.where import AND
+from django.test.signals import setting_changed
+from django.utils.datastructures import SortedDict
+from django.utils.module_loading import import_by_path
+
+
+def hash_function(value, aliases):
+    """ Distributes integer keys by modulo, other keys by CRC32."""
+    if not isinstance(value, (int, long)):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        value = zlib.crc32(str(value)) & 0xffffffff
+    return aliases[value % len(aliases)]
+
+
+class ShardPolicy(object):
+    """ Maps shard key values of model to database aliases."""
+
+    def __init__(self, aliases, key='pk', function='hash', ranges=None):
+        if not aliases:
+            raise ValueError("Shard aliases list is empty")
+        self.aliases = list(aliases)
+        self.key = key
+        if function == 'range':
+            if len(ranges or ()) != len(self.aliases) - 1:
+                raise ValueError("Number of ranges must be one less than "
+                                 "number of aliases")
+            self.ranges = list(ranges)
+            function = self.range_function
+        elif function == 'hash':
+            function = hash_function
+        elif isinstance(function, basestring):
+            function = import_by_path(function)
+        self.function = function
+
+    def range_function(self, value, aliases):
+        return aliases[bisect_right(self.ranges, value)]
+
+    def get_alias(self, value):
+        return self.function(value, self.aliases)
+
+    def get_key_field(self, model):
+        opts = model._meta
+        return opts.pk if self.key == 'pk' else opts.get_field(self.key)
+
+    def get_instance_alias(self, obj):
+        """ Returns alias for model instance, None if key is not set."""
+        value = getattr(obj, self.get_key_field(type(obj)).attname)
+        if value is None:
+            return None
+        return self.get_alias(value)
+
+    def group_instances(self, objs):
+        """ Returns {alias: [objs]} preserving order of objects."""
+        result = SortedDict()
+        for obj in objs:
+            result.setdefault(self.get_instance_alias(obj), []).append(obj)
+        return result
+
+    def group_values(self, values):
+        result = SortedDict()
+        for value in values:
+            result.setdefault(self.get_alias(value), []).append(value)
+        return result
+
+
+# ShardPolicy (or None) by model, cleared when SPHINX_SHARDS is changed
+_policies = {}
+
+
+def get_policy(model):
+    """ Returns ShardPolicy of model or None if it's not sharded."""
+    try:
+        return _policies[model]
+    except KeyError:
+        pass
+    policy = None
+    shards = getattr(settings, 'SPHINX_SHARDS', None)
+    if shards:
+        opts = model._meta
+        config = shards.get('%s.%s' % (opts.app_label, opts.object_name))
+        if config is not None:
+            policy = ShardPolicy(**config)
+    _policies[model] = policy
+    return policy
+
+
+def clear_policies(setting, **kwargs):
+    if setting == 'SPHINX_SHARDS':
+        _policies.clear()
+
+setting_changed.connect(clear_policies)
+
+
+def find_key_lookup(where, field):
+    """ Returns (index, child) of exact or IN lookup on field in top-level
+    AND node of where tree, None if there is no such lookup."""
+    if where.negated or where.connector != AND:
+        return None
+    for index, child in enumerate(where.children):
+        if not isinstance(child, tuple):
+            continue
+        constraint, lookup_type, value_annot, value = child
+        if (getattr(constraint, 'field', None) is field and
+                lookup_type in ('exact', 'in')):
+            return index, child
+    return None
@@ -1,3 +1,8 @@
+from MySQLdb.cursors import SSCursor
+
+from django.conf import settings
+from django.db.backends import util
+from django.db.backends.mysql.base import CursorWrapper
 from django.db.backends.mysql.base import DatabaseWrapper as MySQLDatabaseWrapper
 from django.db.backends.mysql.base import DatabaseOperations as MySQLDatabaseOperations
 from django.db.backends.mysql.creation import DatabaseCreation as MySQLDatabaseCreation
@@ -52,3 +57,19 @@ class DatabaseWrapper(MySQLDatabaseWrapper):
         # use transactions for clearing data between tests when all OTHER backends
         # support it.
         self.features.supports_transactions = True
+
+    def stream_cursor(self):
+        """ Creates unbuffered server-side cursor.
+
+        Cursor is wrapped like ones returned by cursor(), so errors are
+        translated and queries are logged if DEBUG is set. Connection can't
+        execute other queries until cursor is read to the end or closed.
+        """
+        self.validate_thread_sharing()
+        self.ensure_connection()
+        with self.wrap_database_errors:
+            cursor = CursorWrapper(self.connection.cursor(SSCursor))
+        if (self.use_debug_cursor or
+                (self.use_debug_cursor is None and settings.DEBUG)):
+            return self.make_debug_cursor(cursor)
+        return util.CursorWrapper(cursor, self)
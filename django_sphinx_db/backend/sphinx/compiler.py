@@ -1,7 +1,10 @@
 # coding: utf-8
+import copy
 import django
 
+from django.conf import settings
 from django.db.models.sql import compiler
+from django.db.models.sql.constants import MULTI, SINGLE
 from django.db.models.sql.query import get_order_dir, ORDER_DIR
 
 from django.db.models.sql.where import WhereNode, ExtraWhere, AND
@@ -9,11 +12,26 @@ from django.db.models.sql.where import EmptyShortCircuit, EmptyResultSet
 from django.db.models.sql.expressions import SQLEvaluator
 import re
 from django.utils.datastructures import SortedDict
+from django_sphinx_db.backend.sphinx.expressions import Weights
+from django_sphinx_db.backend.memo import get_memo, invalidate_memo
+from django_sphinx_db.backend.deadline import get_deadline, read_timeout
+from django_sphinx_db.backend import hedging
+from django_sphinx_db.backend.hedging import get_hedge_aliases
+from django_sphinx_db.backend.recorder import get_recorder
+from django_sphinx_db.backend.cost import check_query
 
 DJANGO15 = (1, 5, 0, 'alpha', 0)
 DJANGO16 = (1, 6, 0, 'alpha', 0)
 DJANGO17 = (1, 7, 0, 'alpha', 0)
 
+# searchd default for max_matches, slices below it don't need OPTION
+SPHINX_DEFAULT_MAX_MATCHES = 1000
+
+# names accepted in FACET ORDER BY besides facet expressions
+FACET_ORDER_ALIASES = {
+    'count': 'COUNT(*)',
+}
+
 
 class SphinxExtraWhere(ExtraWhere):
 
@@ -34,6 +52,8 @@ class SphinxWhereNode(WhereNode):
         Transform search, the keyword should not be quoted.
         """
         lvalue, lookup_type, value_annot, params_or_value = child
+        if lookup_type == 'all':
+            return self.make_all_atom(child, qn, connection)
         sql, params = super(SphinxWhereNode, self).make_atom(child, qn, connection)
         if lookup_type == 'search':
             if hasattr(lvalue, 'process'):
@@ -69,6 +89,19 @@ class SphinxWhereNode(WhereNode):
                 raise ValueError("Negative '%s' lookup not supported" % lookup_type)
         return sql, params
 
+    def make_all_atom(self, child, qn, connection):
+        """ MVA contains all values: mva = value1 AND mva = value2."""
+        lvalue, lookup_type, value_annot, params_or_value = child
+        if getattr(self, '_real_negated', False):
+            raise ValueError("Negative '%s' lookup not supported" % lookup_type)
+        try:
+            lvalue, params = lvalue.process(lookup_type, params_or_value, connection)
+        except EmptyShortCircuit:
+            raise EmptyResultSet
+        field_sql = self.sql_for_columns(lvalue, qn, connection)
+        sql = ' AND '.join(['%s = %%s' % field_sql] * len(params))
+        return sql, params
+
     def as_sql(self, qn, connection):
         if not hasattr(self, '_real_negated'):
             self._real_negated = self.negated
@@ -92,15 +125,18 @@ class SphinxQLCompiler(compiler.SQLCompiler):
             columns = result
         else:
             columns = result[0]
-        db_table = self.query.model._meta.db_table
         for i, column in enumerate(columns):
-            if column.startswith(db_table + '.'):
-                column = column.partition('.')[2]
-            # fix not accepted expression (bool(value)) AS v
-            columns[i] = re.sub(r"^\((.*)\) AS ([\w\d\_]+)$", '\\1 AS \\2',
-                                column)
+            columns[i] = self.fix_column(column)
         return result
 
+    def fix_column(self, column):
+        """ Removes index name and parentheses around select expression."""
+        db_table = self.query.model._meta.db_table
+        if column.startswith(db_table + '.'):
+            column = column.partition('.')[2]
+        # fix not accepted expression (bool(value)) AS v
+        return re.sub(r"^\((.*)\) AS ([\w\d\_]+)$", '\\1 AS \\2', column)
+
     def quote_name_unless_alias(self, name):
         # TODO: remove this when no longer needed.
         # This is to remove the `` backticks from identifiers.
@@ -120,16 +156,18 @@ class SphinxQLCompiler(compiler.SQLCompiler):
         exclude = {g[0] for g in self.query.extra_select.values()}
         group_by = [g for g in group_by if g[0] not in exclude]
 
-        # processing result ('idx.field1', 'idx.field2')
-        func = lambda name: name.split('.', 1)[-1]
+        # processing result ('idx.field1', 'idx.field2'),
+        # JSON paths like 'meta.popularity' are left as is
+        prefix = self.query.model._meta.db_table + '.'
+        func = lambda name: name[len(prefix):] if name.startswith(prefix) else name
         result = map(func, result)
 
         # processing group_by tuples: (('idx.field1', []), ('idx.field2', []))
         group_by = map(lambda t: (func(t[0]),) + t[1:], group_by)
 
-        # TODO: process self.query.ordering_aliases
-        # self.query.ordering_aliases is also set by parent get_ordering()
-        # method, and it also may contain db_table name.
+        # expressions ordered by, but not selected (i.e. GEODIST() of
+        # values_list() queries) are added to select list as ordering aliases
+        self.ordering_aliases = map(self.fix_column, self.ordering_aliases)
 
         if django.VERSION < DJANGO16:
             return result, group_by
@@ -165,65 +203,43 @@ class SphinxQLCompiler(compiler.SQLCompiler):
                 result[i] = g[1:-1]
         return result, params
 
-    def _serialize(self, values_list):
-        if isinstance(values_list, basestring):
-            return values_list
-        ensure_list = lambda s:  [s] if isinstance(s, basestring) else s
-        values_list = [item for s in values_list for item in ensure_list(s)]
-        positive_list = filter(lambda s: not s.startswith('-'), values_list)
-        negative_list = filter(lambda s: s.startswith('-'), values_list)
-        def quote(s, negative=True):
-            prefix = '-' if negative else ''
-            if s.startswith('"'):
-                return s
-            negative = s.startswith('-')
-            if not negative:
-                return '"%s"' % s
-            s = s[1:]
-            if s.startswith('"'):
-                return '%s%s' % (prefix, s)
-            return '%s"%s"' % (prefix, s)
-
-        positive = "|".join(map(quote, positive_list))
-        if not positive_list:
-            negative = '|'.join(quote(n, negative=False) for n in negative_list)
-            template = '%s -(%s)'
-        else:
-            negative = ' '.join(map(quote, negative_list))
-            template = '%s %s'
-        result = template % (positive.strip(' '), negative.strip(' '))
-        return result.strip(' ')
+    def get_match_expression(self):
+        """ Returns MATCH expression text built from query.match or None."""
+        match = getattr(self.query, 'match', None)
+        if not match:
+            return None
+        return match.as_sphinx(self.get_match_column)
 
-    def as_sql(self, with_limits=True, with_col_aliases=False):
+    def get_match_column(self, name):
+        """ Returns full-text field name for MATCH field scope."""
+        field = self.query.model._meta.get_field(name)
+        return field.db_column or field.attname
+
+    def as_sql(self, with_limits=True, with_col_aliases=False,
+               with_deadline=True):
         """ Patching final SQL query."""
-        match = getattr(self.query, 'match', None)
-        if match:
-            expression = []
-            all_field_expr = []
-            all_fields_lookup = match.get('*')
-            if all_fields_lookup:
-                if isinstance(all_fields_lookup, basestring):
-                    expression.append(all_fields_lookup)
-                    all_field_expr.append(all_fields_lookup)
-                else:
-                    for value in all_fields_lookup:
-                        value_str = self._serialize(value)
-                        expression.append(value_str)
-                        all_field_expr.append(value_str)
-            for sphinx_attr, lookup in match.items():
-                if sphinx_attr == '*':
-                    continue
-                field = self.query.model._meta.get_field(sphinx_attr)
-                db_column = field.db_column or field.attname
-                expression.append('@' + db_column)
-                expression.append("(%s)" % self._serialize(lookup))
-            decode = lambda _: _.decode("utf-8") if type(_) is str else _
-            match_expr = u"MATCH('%s')" % u' '.join(map(decode, expression))
+        match_expression = self.get_match_expression()
+        where = self.query.where
+        if match_expression is not None:
+            # MATCH is added to a copy of where, so compilation doesn't
+            # change the query and match is kept for snippets.
+            if hasattr(where, 'clone'):
+                self.query.where = where.clone()
+            else:
+                self.query.where = copy.deepcopy(where)
+            match_expr = u"MATCH('%s')" % match_expression
             self.query.where.add(SphinxExtraWhere([match_expr], []), AND)
-        self.query.match = dict()
-        sql, args = super(SphinxQLCompiler, self).as_sql(with_limits,
-                                                         with_col_aliases)
+        try:
+            sql, args = super(SphinxQLCompiler, self).as_sql(with_limits,
+                                                             with_col_aliases)
+        except EmptyResultSet:
+            # query is not sent, SHOW META would describe the previous one
+            self.query.meta_results = {}
+            raise
+        finally:
+            self.query.where = where
         if (sql, args) == ('', ()):
+            self.query.meta_results = {}
             return sql, args
         # removing unsupported OFFSET clause
         # replacing it with LIMIT <offset>, <limit>
@@ -244,17 +260,245 @@ class SphinxQLCompiler(compiler.SQLCompiler):
 
         # adding sphinx OPTION clause
         # TODO: syntax check for option values is not performed
-        options = getattr(self.query, 'options', None)
+        options = self.get_options(with_limits, with_deadline)
         if options:
             sql += ' OPTION %s' % ', '.join(
-                ["%s=%s" % i for i in options.items()]) or ''
+                ["%s=%s" % (name, self.format_option(value))
+                 for name, value in options.items()]) or ''
+
+        # adding FACET clauses, they must follow OPTION
+        sql += self.get_facets()
 
         # percents, added by raw formatting queries, escaped as %%
-        sql = re.sub(r'(%[^s])', '%%\1', sql)
+        sql = re.sub(r'(%[^s])', r'%\1', sql)
         if not isinstance(sql, unicode):
             sql = sql.decode("utf-8")
         return sql, args
 
+    def get_max_matches(self):
+        """ Computes max_matches option value needed for query slice.
+
+        Value is rounded up to SPHINX_MAX_MATCHES_BUCKET, so different pages
+        of the same query share few distinct query shapes. Slices beyond
+        SPHINX_MAX_MATCHES_LIMIT are rejected to prevent huge sorts in searchd.
+        """
+        high_mark = self.query.high_mark
+        if high_mark is None or high_mark <= SPHINX_DEFAULT_MAX_MATCHES:
+            return None
+        limit = getattr(settings, 'SPHINX_MAX_MATCHES_LIMIT', 100000)
+        if high_mark > limit:
+            raise ValueError("Slice end %s exceeds SPHINX_MAX_MATCHES_LIMIT=%s"
+                             % (high_mark, limit))
+        bucket = getattr(settings, 'SPHINX_MAX_MATCHES_BUCKET',
+                         SPHINX_DEFAULT_MAX_MATCHES)
+        max_matches = -(-high_mark // bucket) * bucket
+        return min(max_matches, limit)
+
+    def get_options(self, with_limits=True, with_deadline=True):
+        """ Returns OPTION clause values.
+
+        max_matches and cutoff are derived from query limits, options passed
+        explicitly with SphinxQuerySet.options() take precedence.
+        max_query_time is limited by remaining time of active deadline.
+        """
+        options = SortedDict()
+        if with_limits:
+            max_matches = self.get_max_matches()
+            if max_matches:
+                options['max_matches'] = max_matches
+        cutoff = getattr(self.query, 'cutoff', None)
+        if cutoff:
+            options['cutoff'] = cutoff
+        options.update(getattr(self.query, 'options', None) or {})
+        deadline = get_deadline() if with_deadline else None
+        if deadline is not None:
+            # max_query_time=0 means no limit
+            remaining = max(deadline.remaining_ms(), 1)
+            max_query_time = options.get('max_query_time')
+            if max_query_time:
+                remaining = min(remaining, int(max_query_time))
+            options['max_query_time'] = remaining
+        return options
+
+    def format_option(self, value):
+        """ Renders OPTION value: Ranker, Weights or dict of weights."""
+        if hasattr(value, 'as_sql'):
+            return value.as_sql()
+        if isinstance(value, dict):
+            return Weights(value).as_sql()
+        return value
+
+    def get_facets(self):
+        """ Returns FACET clauses for query."""
+        facets = getattr(self.query, 'facets', None)
+        if not facets:
+            return ''
+        asc, desc = ORDER_DIR['ASC']
+        result = []
+        for name, expression, order_by, limit in facets:
+            facet = ' FACET %s' % expression
+            if order_by:
+                ordering = []
+                for item in order_by:
+                    col, order = get_order_dir(item, asc)
+                    col = FACET_ORDER_ALIASES.get(col, col)
+                    ordering.append("%s %s" % (col, order))
+                facet += ' ORDER BY ' + ', '.join(ordering)
+            if limit:
+                facet += ' LIMIT %d' % limit
+            result.append(facet)
+        return ''.join(result)
+
+    def fetch_facets(self, cursor):
+        """ Reads FACET result sets following main query result.
+
+        Returns dict {facet_name: {value: count}}.
+        """
+        result = SortedDict()
+        for name, expression, order_by, limit in self.query.facets:
+            if not cursor.nextset():
+                break
+            result[name] = SortedDict(
+                (row[0], row[-1]) for row in cursor.fetchall())
+        return result
+
+    def execute_stream(self, chunk_size):
+        """ Executes query with unbuffered server-side cursor.
+
+        Returns iterator over chunks of at most chunk_size rows. Cursor is
+        closed when all rows are read or iterator is closed or garbage
+        collected, until then connection can't execute other queries.
+        """
+        try:
+            sql, params = self.as_sql()
+            if not sql:
+                raise EmptyResultSet
+        except EmptyResultSet:
+            return iter([])
+        cursor = self.connection.stream_cursor()
+        try:
+            cursor.execute(sql, params)
+        except Exception:
+            cursor.close()
+            raise
+        strip = len(self.ordering_aliases)
+
+        def fetch_chunks():
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if strip:
+                        rows = [row[:-strip] for row in rows]
+                    yield rows
+            finally:
+                cursor.close()
+        return fetch_chunks()
+
+    def execute_sql(self, result_type=MULTI):
+        """ Reads all result sets of query with FACET clauses.
+
+        Query marked with stream_chunk_size is read with unbuffered cursor.
+        Results are shared by identical queries while query memo is active,
+        reads are hedged to replicas if SPHINX_HEDGING is set. Sampled reads
+        are recorded if SPHINX_QUERY_RECORDER is set, cost of queries is
+        checked if SPHINX_QUERY_COST is set (once for all chunk queries).
+        """
+        if result_type and not getattr(self.query, 'cost_checked', False):
+            check_query(self.query)
+        deadline = get_deadline()
+        if result_type and deadline is not None and deadline.expired():
+            # budget is spent, query is not sent to searchd
+            deadline.exceeded = True
+            self.query.meta_results = {}
+            return iter([]) if result_type == MULTI else None
+        chunk_size = getattr(self.query, 'stream_chunk_size', None)
+        if chunk_size and result_type == MULTI:
+            return self.execute_stream(chunk_size)
+        recorder = get_recorder() if result_type else None
+        if recorder is not None and recorder.sample():
+            self.record_query(recorder)
+        memo = get_memo()
+        facets = getattr(self.query, 'facets', None)
+        replicas = get_hedge_aliases(self.using)
+        if not result_type or (memo is None and not facets and not replicas):
+            with read_timeout(self.connection, deadline):
+                return super(SphinxQLCompiler, self).execute_sql(result_type)
+        # SHOW META must follow the query on the same connection
+        with_meta = bool(getattr(self.query, 'with_meta', False))
+        try:
+            sql, params = self.as_sql(with_deadline=memo is None)
+            if not sql:
+                raise EmptyResultSet
+        except EmptyResultSet:
+            return iter([]) if result_type == MULTI else None
+
+        def fetch():
+            if memo is None or deadline is None:
+                query = sql, params
+            else:
+                # memo key doesn't depend on remaining time
+                query = self.as_sql()
+            if replicas:
+                return hedging.execute(
+                    self.using, replicas,
+                    lambda connection: self.fetch_results(
+                        query[0], query[1], with_meta, connection))
+            return self.fetch_results(query[0], query[1], with_meta)
+        if memo is None:
+            rows, facet_results, meta = fetch()
+        else:
+            key = (self.using, sql, repr(params), with_meta)
+            rows, facet_results, meta = memo.get(key, fetch)
+        self.query.meta_results = meta
+        if facets:
+            self.query.facet_results = facet_results
+        if result_type == SINGLE:
+            return rows[0] if rows else None
+        return iter([rows])
+
+    def record_query(self, recorder):
+        """ Passes compiled query to recorder, without deadline options."""
+        try:
+            sql, params = self.as_sql(with_deadline=False)
+        except EmptyResultSet:
+            return
+        if sql:
+            recorder.record(sql, params)
+
+    def fetch_results(self, sql, params, with_meta=False, connection=None):
+        """ Executes query and reads all its result sets.
+
+        Returns (rows, facet results, SHOW META result or None).
+        """
+        connection = connection or self.connection
+        cursor = connection.cursor()
+        try:
+            with read_timeout(connection, get_deadline()):
+                cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            if self.ordering_aliases:
+                rows = [row[:-len(self.ordering_aliases)] for row in rows]
+            facet_results = None
+            if getattr(self.query, 'facets', None):
+                facet_results = self.fetch_facets(cursor)
+        finally:
+            cursor.close()
+        meta = self.fetch_meta(connection) if with_meta else None
+        return rows, facet_results, meta
+
+    def fetch_meta(self, connection=None):
+        """ Returns SHOW META result for the last query on connection."""
+        cursor = (connection or self.connection).cursor()
+        try:
+            cursor.execute("SHOW META")
+            return dict(cursor.fetchall())
+        except UnicodeDecodeError:
+            return {}
+        finally:
+            cursor.close()
+
     def get_group_ordering(self):
         group_order_by = getattr(self.query, 'group_order_by', ())
         asc, desc = ORDER_DIR['ASC']
@@ -271,14 +515,52 @@ SQLCompiler = SphinxQLCompiler
 
 
 class SQLInsertCompiler(compiler.SQLInsertCompiler, SphinxQLCompiler):
-    pass
+    def execute_sql(self, *args, **kwargs):
+        try:
+            return super(SQLInsertCompiler, self).execute_sql(*args, **kwargs)
+        finally:
+            invalidate_memo()
+
+    def as_sql(self):
+        """ Converts values of fields having get_db_prep_batch at once.
+
+        Converted values temporarily replace raw values of objects, so
+        pre_save of these fields returns them as is.
+        """
+        objs = self.query.objs
+        saved = []
+        if not self.query.raw:
+            for field in self.query.fields:
+                if not hasattr(field, 'get_db_prep_batch'):
+                    continue
+                values = [field.pre_save(obj, True) for obj in objs]
+                saved.append((field, values))
+                prepared = field.get_db_prep_batch(values)
+                for obj, value in zip(objs, prepared):
+                    obj.__dict__[field.attname] = value
+        try:
+            return super(SQLInsertCompiler, self).as_sql()
+        finally:
+            for field, values in saved:
+                for obj, value in zip(objs, values):
+                    obj.__dict__[field.attname] = value
 
 
 class SQLDeleteCompiler(compiler.SQLDeleteCompiler, SphinxQLCompiler):
-    pass
+    def execute_sql(self, *args, **kwargs):
+        try:
+            return super(SQLDeleteCompiler, self).execute_sql(*args, **kwargs)
+        finally:
+            invalidate_memo()
 
 
 class SQLUpdateCompiler(compiler.SQLUpdateCompiler, SphinxQLCompiler):
+    def execute_sql(self, *args, **kwargs):
+        try:
+            return super(SQLUpdateCompiler, self).execute_sql(*args, **kwargs)
+        finally:
+            invalidate_memo()
+
     def as_sql(self):
         qn = self.connection.ops.quote_name
         opts = self.query.model._meta
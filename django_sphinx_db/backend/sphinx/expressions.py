@@ -0,0 +1,117 @@
+# coding: utf-8
+
+
+class Expr(object):
+    """ SphinxQL expression, added to select list by SphinxQuerySet.annotate.
+
+    qs.annotate(rank=Weight() * 0.7 + Expr('LN(views)') * 0.3).order_by('-rank')
+        compiles to
+    SELECT WEIGHT() * 0.7 + LN(views) * 0.3 AS rank, ... ORDER BY rank DESC
+
+    Sphinx can't order by expressions, only by their aliases.
+    """
+
+    # additive expressions are wrapped when used as operands
+    additive = False
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def as_sql(self):
+        return self.expression
+
+    def _operand(self, value):
+        if not isinstance(value, Expr):
+            return str(value)
+        if value.additive:
+            return '(%s)' % value.as_sql()
+        return value.as_sql()
+
+    def _combine(self, other, connector, reversed=False):
+        lhs, rhs = self._operand(self), self._operand(other)
+        if reversed:
+            lhs, rhs = rhs, lhs
+        result = Expr('%s %s %s' % (lhs, connector, rhs))
+        result.additive = connector in ('+', '-')
+        return result
+
+    def __add__(self, other):
+        return self._combine(other, '+')
+
+    def __radd__(self, other):
+        return self._combine(other, '+', reversed=True)
+
+    def __sub__(self, other):
+        return self._combine(other, '-')
+
+    def __rsub__(self, other):
+        return self._combine(other, '-', reversed=True)
+
+    def __mul__(self, other):
+        return self._combine(other, '*')
+
+    def __rmul__(self, other):
+        return self._combine(other, '*', reversed=True)
+
+    def __div__(self, other):
+        return self._combine(other, '/')
+
+    def __rdiv__(self, other):
+        return self._combine(other, '/', reversed=True)
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __unicode__(self):
+        return self.as_sql()
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.as_sql())
+
+
+class Weight(Expr):
+    """ Text relevance of matched document: WEIGHT()."""
+
+    def __init__(self):
+        super(Weight, self).__init__('WEIGHT()')
+
+
+class Ranker(object):
+    """ Value of OPTION ranker.
+
+    qs.options(ranker=Ranker('sph04'))
+    qs.options(ranker=Ranker.expr('sum(lcs*user_weight)*1000+bm25'))
+    """
+
+    def __init__(self, name, expression=None):
+        self.name = name
+        self.expression = expression
+
+    @classmethod
+    def expr(cls, expression):
+        return cls('expr', expression)
+
+    @classmethod
+    def export(cls, expression):
+        return cls('export', expression)
+
+    def as_sql(self):
+        if self.expression is None:
+            return self.name
+        # backslash is escaped first, not to double escapes of quotes
+        expression = self.expression.replace('\\', '\\\\').replace(
+            "'", "\\'")
+        return "%s('%s')" % (self.name, expression)
+
+
+class Weights(dict):
+    """ Value of OPTION field_weights and index_weights.
+
+    qs.options(field_weights=Weights(title=10, content=1))
+        compiles to
+    OPTION field_weights=(content=1, title=10)
+    """
+
+    def as_sql(self):
+        return '(%s)' % ', '.join(
+            '%s=%d' % item for item in sorted(self.items()))
@@ -0,0 +1,318 @@
+# coding: utf-8
+""" MATCH expression tree.
+
+Nodes are combined like Q objects:
+
+    (Term('cat') | Phrase('funny dog', proximity=2)) & ~Term('fake')
+        compiles to
+    cat|"funny dog"~2 -fake
+
+Text is escaped once when node is created, duplicate nodes are dropped when
+added to groups, so expression is serialized in single pass.
+"""
+import re
+
+ESCAPE_RE = re.compile(r'''[=<>()|!@~&/^$\-'"\\]|SENTENCE|PARAGRAPH''', re.I)
+
+
+def sphinx_escape(value):
+    if type(value) not in (str, unicode):
+        return value
+    return ESCAPE_RE.sub(r'\\\g<0>', value)
+
+
+def to_unicode(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    if not isinstance(value, unicode):
+        return unicode(value)
+    return value
+
+
+class Node(object):
+    """ Base class of MATCH expression tree nodes."""
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def key(self):
+        """ Hashable value identifying node, used for deduplication."""
+        raise NotImplementedError()
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __nonzero__(self):
+        return True
+
+    def serialize(self, result, get_column):
+        """ Appends node text to result list."""
+        raise NotImplementedError()
+
+    def as_sphinx(self, get_column=None):
+        """ Returns node text, get_column maps field names to columns."""
+        result = []
+        self.serialize(result, get_column or (lambda name: name))
+        return u''.join(result)
+
+    def __unicode__(self):
+        return self.as_sphinx()
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__,
+                             self.as_sphinx().encode('utf-8'))
+
+
+class Raw(Node):
+    """ Expression in sphinx syntax, used as is."""
+
+    def __init__(self, expression):
+        self.text = to_unicode(expression)
+
+    def key(self):
+        return 'raw', self.text
+
+    def serialize(self, result, get_column):
+        result.append(self.text)
+
+
+class Term(Node):
+    """ Single keyword, prefix=True matches all keywords starting with it."""
+
+    def __init__(self, word, prefix=False, escape=True):
+        word = to_unicode(word)
+        self.text = sphinx_escape(word) if escape else word
+        if prefix:
+            self.text += u'*'
+
+    def key(self):
+        return 'term', self.text
+
+    def serialize(self, result, get_column):
+        result.append(self.text)
+
+
+class Phrase(Node):
+    """ Exact phrase, proximity=N allows up to N words between keywords."""
+
+    def __init__(self, text, proximity=None, prefix=False, escape=True):
+        text = to_unicode(text)
+        self.text = sphinx_escape(text) if escape else text
+        if prefix:
+            self.text += u'*'
+        self.proximity = proximity
+
+    def key(self):
+        return 'phrase', self.text, self.proximity
+
+    def serialize(self, result, get_column):
+        result.append(u'"%s"' % self.text)
+        if self.proximity:
+            result.append(u'~%d' % self.proximity)
+
+
+def serialize_operand(node, result, get_column, wrap=lambda group: True):
+    """ Serializes operand of AND/OR/NOT, wrapping groups and field scopes
+    in parentheses."""
+    # single-child groups don't need parentheses
+    while isinstance(node, Group) and len(node.children) == 1:
+        node = node.children[0]
+    # @field scope would spread to the following operands
+    if isinstance(node, Field) or (isinstance(node, Group) and wrap(node)):
+        result.append(u'(')
+        node.serialize(result, get_column)
+        result.append(u')')
+    else:
+        node.serialize(result, get_column)
+
+
+class Group(Node):
+    """ Base class for nodes with children."""
+
+    def __init__(self, *children):
+        self.children = []
+        self._keys = set()
+        for child in children:
+            self.add(child)
+
+    def add(self, child):
+        """ Adds child, flattening nested groups of the same type and
+        dropping duplicates and empty groups."""
+        if isinstance(child, self.__class__):
+            for c in child.children:
+                self.add(c)
+            return
+        if isinstance(child, Group) and not child:
+            return
+        key = child.key()
+        if key not in self._keys:
+            self._keys.add(key)
+            self.children.append(child)
+
+    def key(self):
+        return (self.__class__.__name__,) + tuple(
+            c.key() for c in self.children)
+
+    def __nonzero__(self):
+        return bool(self.children)
+
+
+class And(Group):
+    """ All children must match, negative children go last."""
+
+    @staticmethod
+    def wraps(group):
+        # OR has higher priority than AND in sphinx syntax
+        return not isinstance(group, Or)
+
+    def serialize(self, result, get_column):
+        positive = [c for c in self.children if not isinstance(c, Not)]
+        negative = [c for c in self.children if isinstance(c, Not)]
+        if not positive and len(negative) > 1:
+            # -a -b => -(a|b)
+            node = Not(Or(*[n.child for n in negative]))
+            return node.serialize(result, get_column)
+        for i, child in enumerate(positive + negative):
+            if i:
+                result.append(u' ')
+            serialize_operand(child, result, get_column, self.wraps)
+
+
+class Or(Group):
+    """ Any of children must match."""
+
+    def serialize(self, result, get_column):
+        for i, child in enumerate(self.children):
+            if i:
+                result.append(u'|')
+            serialize_operand(child, result, get_column)
+
+
+class Scope(Group):
+    """ Lookups of a single field: positive children are OR-ed, negative
+    ones are excluded, so chained filter(name=...) match any of values."""
+
+    def serialize(self, result, get_column):
+        positive = Or(*[c for c in self.children if not isinstance(c, Not)])
+        node = And(positive, *[c for c in self.children if isinstance(c, Not)])
+        node.serialize(result, get_column)
+
+
+class Not(Node):
+    """ Child must not match."""
+
+    def __init__(self, child):
+        self.child = child
+
+    def __invert__(self):
+        return self.child
+
+    def key(self):
+        return 'not', self.child.key()
+
+    def serialize(self, result, get_column):
+        result.append(u'-')
+        serialize_operand(self.child, result, get_column)
+
+
+class Field(Node):
+    """ Child is searched only in given field: @field (child)."""
+
+    def __init__(self, name, child):
+        self.name = name
+        self.child = child
+
+    def key(self):
+        return 'field', self.name, self.child.key()
+
+    def serialize(self, result, get_column):
+        result.append(u'@%s (' % get_column(self.name))
+        self.child.serialize(result, get_column)
+        result.append(u')')
+
+
+class Match(Node):
+    """ Root of MATCH expression: expressions for all fields ('*') followed
+    by field scopes, each field scope occurs once. Expressions for all
+    fields are AND-ed, lookups of field scope are combined by Scope."""
+
+    def __init__(self):
+        self.scopes = {}
+        self.fields = []
+
+    def clone(self):
+        result = Match()
+        for field in self.fields:
+            result.add(self.scopes[field], field)
+        return result
+
+    def add(self, node, field='*'):
+        if field not in self.scopes:
+            self.scopes[field] = And() if field == '*' else Scope()
+            if field == '*':
+                self.fields.insert(0, field)
+            else:
+                self.fields.append(field)
+        self.scopes[field].add(node)
+
+    def key(self):
+        return tuple((f, self.scopes[f].key()) for f in self.fields)
+
+    def __nonzero__(self):
+        return any(self.scopes.values())
+
+    def serialize(self, result, get_column):
+        first = True
+        for field in self.fields:
+            group = self.scopes[field]
+            if not group:
+                continue
+            if not first:
+                result.append(u' ')
+            first = False
+            if field == '*':
+                group.serialize(result, get_column)
+            else:
+                Field(field, group).serialize(result, get_column)
+
+
+def parse_lookup(value):
+    """ Converts match() field lookup to node.
+
+    Strings are treated as phrases unless already quoted, leading '-' means
+    negation. Collections are OR-ed, negative items excluded.
+    """
+    if isinstance(value, Node):
+        return value
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return Scope(*[parse_lookup(v) for v in value])
+    value = to_unicode(value)
+    if value.startswith(u'-'):
+        return Not(parse_lookup(value[1:]))
+    if value.startswith(u'"'):
+        return Raw(value)
+    return Phrase(value, escape=False)
+
+
+def parse_expression(value):
+    """ Converts match() positional argument to node.
+
+    Strings are sphinx expressions used as is, lists are AND-ed.
+    """
+    if isinstance(value, Node):
+        return value
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return And(*[parse_expression(v) for v in value])
+    return Raw(value)
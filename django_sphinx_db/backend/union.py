@@ -0,0 +1,164 @@
+# coding: utf-8
+""" Search in several indexes with one multi-index query.
+
+    sphinx_union(VideoIndex.objects.match(q), ChannelIndex.objects.match(q))
+
+compiles to
+
+    SELECT WEIGHT() AS weight, id, index_marker, ...
+    FROM video_idx, channel_idx WHERE MATCH(...) ORDER BY weight DESC
+
+Only attributes present in all indexes are selected. Each index must have
+marker attribute (SPHINX_UNION_MARKER, 'index_marker' by default) with
+distinct constant value equal to default of model field, i.e.
+
+    index_marker = models.IntegerField(default=1)
+
+Rows are returned as instances of models owning them, with other fields
+deferred.
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models.query_utils import deferred_class_factory
+from django.utils.datastructures import SortedDict
+
+from django_sphinx_db.backend.models import SphinxField
+from django_sphinx_db.backend.sphinx.compiler import SphinxQLCompiler
+
+# name of extra select column with WEIGHT()
+WEIGHT_ALIAS = 'weight'
+
+
+class UnionCompiler(SphinxQLCompiler):
+    """ Compiles query of the first index with FROM list of all indexes."""
+
+    tables = None
+
+    def get_from_clause(self):
+        return [', '.join(self.tables)], []
+
+
+def get_columns(model):
+    """ Returns SortedDict {column: field} of model attributes."""
+    result = SortedDict()
+    for field in model._meta.concrete_fields:
+        # full-text fields are not returned by searchd
+        if not isinstance(field, SphinxField):
+            result[field.column] = field
+    return result
+
+
+class SphinxUnion(object):
+    """ Lazy multi-index query, supports iteration and slicing."""
+
+    def __init__(self, querysets, marker=None):
+        if len(querysets) < 2:
+            raise ValueError("sphinx_union needs at least two querysets")
+        self.querysets = list(querysets)
+        self.marker = marker or getattr(settings, 'SPHINX_UNION_MARKER',
+                                        'index_marker')
+        self.low_mark, self.high_mark = 0, None
+        self._result_cache = None
+        self.models = {}
+        for qs in self.querysets:
+            field = qs.model._meta.get_field(self.marker)
+            value = field.get_default()
+            if value in self.models:
+                raise ValueError("%s and %s have the same %s value %r" % (
+                    self.models[value].__name__, qs.model.__name__,
+                    self.marker, value))
+            self.models[value] = qs.model
+        self.columns = self.get_common_columns()
+        if field.column not in self.columns:
+            raise ValueError("%s attribute is not in all indexes" %
+                             self.marker)
+        self.marker_index = self.columns.index(field.column)
+
+    def get_common_columns(self):
+        """ Returns columns of attributes present in all indexes."""
+        columns = [get_columns(qs.model) for qs in self.querysets]
+        return [column for column in columns[0]
+                if all(column in c for c in columns[1:])]
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice) or k.step is not None:
+            raise ValueError("sphinx_union supports slices only")
+        clone = SphinxUnion(self.querysets, self.marker)
+        clone.low_mark = self.low_mark + (k.start or 0)
+        if k.stop is not None:
+            clone.high_mark = self.low_mark + k.stop
+        return clone
+
+    def __iter__(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+        return iter(self._result_cache)
+
+    def __len__(self):
+        return len(list(self.__iter__()))
+
+    def get_queryset(self, qs):
+        """ Returns values_list queryset selecting common columns."""
+        fields = get_columns(qs.model)
+        names = [fields[column].name for column in self.columns]
+        qs = qs.extra(select={WEIGHT_ALIAS: 'WEIGHT()'})
+        qs = qs.values_list(WEIGHT_ALIAS, *names).order_by('-' + WEIGHT_ALIAS)
+        qs.query.clear_limits()
+        qs.query.set_limits(self.low_mark, self.high_mark)
+        qs.query.facets = None
+        return qs
+
+    def get_compiler(self):
+        """ Returns compiler of multi-index query.
+
+        searchd applies one WHERE clause to all indexes, so querysets must
+        differ by index only, otherwise ValueError is raised.
+        """
+        statements = []
+        for qs in self.querysets:
+            qs = self.get_queryset(qs)
+            compiler = UnionCompiler(qs.query, connections[qs.db], qs.db)
+            compiler.tables = ['%s']
+            statements.append(compiler.as_sql(with_deadline=False))
+        for qs, statement in zip(self.querysets[1:], statements[1:]):
+            if statement != statements[0]:
+                raise ValueError("%s query differs from %s query: %s" % (
+                    qs.model.__name__, self.querysets[0].model.__name__,
+                    statement[0]))
+        qs = self.get_queryset(self.querysets[0])
+        compiler = UnionCompiler(qs.query, connections[qs.db], qs.db)
+        compiler.tables = [q.model._meta.db_table for q in self.querysets]
+        return compiler
+
+    def as_sql(self):
+        return self.get_compiler().as_sql()
+
+    def iterator(self):
+        compiler = self.get_compiler()
+        # weight is the first column
+        marker = self.marker_index + 1
+        classes = {}
+        for value, model in self.models.items():
+            fields = get_columns(model)
+            init_list = [fields[column].attname for column in self.columns]
+            skip = set(f.attname for f in model._meta.concrete_fields
+                       if f.attname not in init_list)
+            if skip:
+                model = deferred_class_factory(model, skip)
+            classes[value] = model, init_list
+        for row in compiler.results_iter():
+            model, init_list = classes[row[marker]]
+            obj = model(**dict(zip(init_list, row[1:])))
+            obj._state.db = compiler.using
+            obj._state.adding = False
+            setattr(obj, WEIGHT_ALIAS, row[0])
+            yield obj
+
+
+def sphinx_union(*querysets, **kwargs):
+    """ Returns results of querysets of several indexes ordered by weight.
+
+    marker: name of attribute identifying index, SPHINX_UNION_MARKER by
+    default.
+    """
+    return SphinxUnion(querysets, kwargs.get('marker'))
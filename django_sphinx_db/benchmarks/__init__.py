@@ -0,0 +1,10 @@
+# coding: utf-8
+""" Offline benchmarks of query compilation and result processing.
+
+    ./manage.py sphinxbench --output before.json
+    git checkout other-branch
+    ./manage.py sphinxbench --compare before.json
+
+Benchmarks don't need searchd: queries are compiled only, results are read
+from rows recorded in benchmarks.cases.
+"""
@@ -0,0 +1,152 @@
+# coding: utf-8
+""" Benchmark cases: compilation of representative querysets, escaping and
+MATCH serialization of large inputs, conversion of recorded rows to model
+instances."""
+from django.db import connection, models
+from django.db.models.sql.constants import MULTI
+from django.utils.datastructures import SortedDict
+
+from django_sphinx_db.backend.fields import (
+    SphinxMultiValueField, SphinxJSONField, UnixTimestampField)
+from django_sphinx_db.backend.models import (
+    SphinxModel, SphinxField, SphinxQuery, SphinxQuerySet, sphinx_escape)
+from django_sphinx_db.backend.sphinx.compiler import SphinxQLCompiler
+from django_sphinx_db.backend.sphinx.expressions import Expr, Ranker, Weight
+from django_sphinx_db.backend.sphinx.match import Match, Or, Phrase, Term
+
+# number of recorded rows read by iterator cases
+ROWS = 1000
+
+
+class BenchVideoIndex(SphinxModel):
+    class Meta:
+        managed = False
+        db_table = 'bench_video_idx'
+        # not an installed app, so the model isn't listed among models of
+        # django_sphinx_db and isn't synced
+        app_label = 'sphinxbench'
+
+    id = models.IntegerField(primary_key=True)
+    title = SphinxField()
+    name = models.CharField(max_length=255)
+    channel_id = models.IntegerField()
+    views = models.IntegerField()
+    rating = models.FloatField()
+    created = UnixTimestampField()
+    tags = SphinxMultiValueField()
+    meta = SphinxJSONField()
+
+
+def make_rows(count):
+    """ Rows as returned by MySQLdb cursor for BenchVideoIndex."""
+    return [(i, u'Video %d' % i, i % 100, i * 7, i / 10.0,
+             1400000000 + i, '%d,%d,%d' % (i, i + 1, i + 2),
+             '{"duration": %d, "hd": true}' % i)
+            for i in xrange(count)]
+
+
+class RecordedCompiler(SphinxQLCompiler):
+    """ Returns recorded rows instead of executing query."""
+
+    def execute_sql(self, result_type=MULTI):
+        rows = self.query.recorded_rows
+        if result_type == MULTI:
+            return iter([rows])
+        return rows[0] if rows else None
+
+
+class RecordedQuery(SphinxQuery):
+
+    def clone(self, *args, **kwargs):
+        query = super(RecordedQuery, self).clone(*args, **kwargs)
+        query.recorded_rows = self.recorded_rows
+        return query
+
+    def get_compiler(self, using=None, connection=connection):
+        return RecordedCompiler(self, connection, using)
+
+
+def recorded_queryset(model, rows):
+    query = RecordedQuery(model)
+    query.recorded_rows = rows
+    return SphinxQuerySet(model, query=query).defer('title')
+
+
+def get_querysets():
+    """ Returns {name: queryset} of representative queries."""
+    objects = BenchVideoIndex.objects
+    return SortedDict([
+        ('match', objects.match(u'funny cats', title=u'-"dog show"')[:20]),
+        ('filters', objects.filter(
+            views__gt=100, channel_id__in=range(50), tags__all=[1, 2],
+            meta__hd=True, name=u'Котики').order_by('-views')[:20]),
+        ('group_by', objects.match(u'cats').group_by(
+            'channel_id', group_limit=3,
+            group_order_by=('-views', 'id')).order_by('-views')[:20]),
+        ('options', objects.match(u'cats').annotate(
+            rank=Weight() * 0.7 + Expr('LN(views)') * 0.3).order_by('-rank')
+            .options(ranker=Ranker.expr('sum(lcs*user_weight)*1000+bm25'),
+                     field_weights={'title': 10, 'name': 1},
+                     max_query_time=100)[:2000]),
+        ('negations', objects.match(u'cats').exclude(
+            channel_id__in=[1, 2, 3]).exclude(id=5).notequal(views=0)[:20]),
+    ])
+
+
+def compiler_case(qs):
+    def setup():
+        query = qs.query
+
+        def run():
+            SphinxQLCompiler(query, connection, None).as_sql()
+        return run
+    return setup
+
+
+def escape_case():
+    text = u'Котики & собаки (2014) - "лучшее"! @title ~5 / ^$ ' * 2000
+
+    def run():
+        sphinx_escape(text)
+    return run
+
+
+def match_case():
+    match = Match()
+    match.add(Or(*[Phrase(u'phrase %d "quoted"' % i) for i in range(500)]))
+    match.add(Or(*[Term(u'term%d' % i, prefix=True) for i in range(500)]),
+              'name')
+
+    def run():
+        match.as_sphinx(lambda name: name)
+    return run
+
+
+def iterator_case():
+    rows = make_rows(ROWS)
+
+    def run():
+        list(recorded_queryset(BenchVideoIndex, rows).iterator())
+    return run
+
+
+def iterator_access_case():
+    rows = make_rows(ROWS)
+
+    def run():
+        for obj in recorded_queryset(BenchVideoIndex, rows).iterator():
+            obj.created, obj.tags, obj.meta
+    return run
+
+
+def get_cases():
+    """ Returns list of (name, setup) benchmark cases."""
+    cases = [('compiler.%s' % name, compiler_case(qs))
+             for name, qs in get_querysets().items()]
+    cases.extend([
+        ('escape.large', escape_case),
+        ('match.serialize', match_case),
+        ('iterator.models', iterator_case),
+        ('iterator.models_access', iterator_access_case),
+    ])
+    return cases
@@ -0,0 +1,83 @@
+# coding: utf-8
+""" Measuring and comparing benchmark results."""
+import gc
+import json
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def measure(func, min_time=0.2, repeat=5):
+    """ Returns dict with ops per second and allocations of func.
+
+    Number of calls is calibrated to take at least min_time, the best of
+    <repeat> runs is taken, GC is disabled while measuring. Peak of memory
+    allocated by one call is measured with tracemalloc if it's available
+    (pytracemalloc for Python 2.7), otherwise it's None.
+    """
+    number = 1
+    elapsed = timeit(func, number)
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timeit(func, number)
+    best = min([elapsed] + [timeit(func, number) for i in range(repeat - 1)])
+    result = {'ops': number / best, 'allocated': None}
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            func()
+            result['allocated'] = tracemalloc.get_traced_memory()[1] - before
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def timeit(func, number):
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.time()
+        for i in xrange(number):
+            func()
+        return time.time() - started
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def run(cases, min_time=0.2, repeat=5):
+    """ Measures each (name, setup) case, setup returns benchmarked func."""
+    results = {}
+    for name, setup in cases:
+        results[name] = measure(setup(), min_time, repeat)
+    return results
+
+
+def format_results(results, baseline=None):
+    """ Returns text table of results, with change against baseline."""
+    lines = []
+    for name in sorted(results):
+        result = results[name]
+        line = '%-32s %12.1f ops/s' % (name, result['ops'])
+        if result.get('allocated') is not None:
+            line += ' %10d B/op' % result['allocated']
+        old = (baseline or {}).get(name)
+        if old:
+            line += ' %+7.1f%%' % ((result['ops'] / old['ops'] - 1) * 100)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
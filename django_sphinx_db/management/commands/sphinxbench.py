@@ -0,0 +1,46 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django_sphinx_db.benchmarks import runner
+from django_sphinx_db.benchmarks.cases import get_cases
+
+
+class Command(BaseCommand):
+    args = '[name_prefix ...]'
+    help = ('Runs offline benchmarks of query compilation and result '
+            'processing, optionally comparing them with saved results.')
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--output',
+            default = None,
+            help = 'Save results to JSON file.',
+        ),
+        make_option(
+            '--compare',
+            default = None,
+            help = 'Show change against results saved to JSON file.',
+        ),
+        make_option(
+            '--min-time',
+            type = 'float',
+            default = 0.2,
+            help = 'Minimum seconds of each measurement.',
+        ),
+        make_option(
+            '--repeat',
+            type = 'int',
+            default = 5,
+            help = 'Number of measurements, the best one is taken.',
+        ),
+    )
+
+    def handle(self, *args, **kwargs):
+        cases = [(name, setup) for name, setup in get_cases()
+                 if not args or name.startswith(args)]
+        results = runner.run(cases, kwargs.get('min_time'),
+                             kwargs.get('repeat'))
+        baseline = None
+        if kwargs.get('compare'):
+            baseline = runner.load(kwargs['compare'])
+        print runner.format_results(results, baseline)
+        if kwargs.get('output'):
+            runner.save(results, kwargs['output'])
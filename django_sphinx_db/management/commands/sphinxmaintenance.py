@@ -0,0 +1,80 @@
+import time
+from optparse import make_option
+from django.conf import settings
+from django.db import connections, OperationalError, ProgrammingError
+from django.core.management.base import BaseCommand
+from django.utils.log import getLogger
+from django_sphinx_db.backend.maintenance import (Scheduler, STATEMENTS,
+                                                 get_index_status)
+from django_sphinx_db.management.commands.syncsphinx import iter_models
+from django_sphinx_db.routers import get_replicas
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Polls SHOW INDEX STATUS of Sphinx models indexes and runs '
+            'FLUSH RTINDEX and OPTIMIZE INDEX when thresholds are crossed.')
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--interval',
+            type = 'int',
+            default = 60,
+            help = 'Seconds between polls.',
+        ),
+        make_option(
+            '--once',
+            action = 'store_true',
+            default = False,
+            help = 'Poll indexes once and exit.',
+        ),
+        make_option(
+            '--dry-run',
+            action = 'store_true',
+            default = False,
+            help = 'Print commands without executing them.',
+        ),
+    )
+
+    def handle(self, *args, **kwargs):
+        alias = getattr(settings, 'SPHINX_DATABASE_NAME', 'sphinx')
+        aliases = [alias] + list(get_replicas(alias))
+        indexes = [(model._meta.db_table, a)
+                   for model in iter_models() for a in aliases]
+        scheduler = Scheduler()
+        while indexes:
+            self.poll(scheduler, indexes, kwargs.get('dry_run'),
+                      int(kwargs.get('verbosity', 1)))
+            if kwargs.get('once'):
+                break
+            # indexes are polled starting from the next one each time, so
+            # postponed actions of the last indexes aren't starved
+            indexes = indexes[1:] + indexes[:1]
+            time.sleep(kwargs.get('interval'))
+
+    def poll(self, scheduler, indexes, dry_run=False, verbosity=1):
+        for index_name, alias in indexes:
+            try:
+                self.poll_index(scheduler, index_name, alias, dry_run,
+                                verbosity)
+            except (OperationalError, ProgrammingError):
+                # unavailable node or index doesn't stop polling of others
+                logger = getLogger("django.db.backends.sphinx")
+                logger.exception(u"Maintenance of %s@%s failed",
+                                 index_name, alias)
+
+    def poll_index(self, scheduler, index_name, alias, dry_run, verbosity):
+        cursor = connections[alias].cursor()
+        try:
+            status = get_index_status(cursor, index_name)
+            if verbosity > 1:
+                print '%s@%s: %s' % (index_name, alias, status)
+            action = scheduler.schedule(status)
+            if action is None:
+                return
+            statement = STATEMENTS[action] % index_name
+            print '%s; -- %s%s' % (statement, alias,
+                                   ' (dry run)' if dry_run else '')
+            if not dry_run:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
@@ -1,11 +1,17 @@
 import inspect
 from optparse import make_option
+from django.db import connections, OperationalError, ProgrammingError
 from django.db.models import fields
 from django.db.models.fields import related
 from django.conf import settings
+from django.utils.datastructures import SortedDict
 from django.utils.importlib import import_module
 from django.core.management.base import BaseCommand
 from django_sphinx_db.backend.models import SphinxModel, SphinxField
+from django_sphinx_db.backend.fields import (SphinxMultiValueField,
+                                             SphinxMultiValue64Field,
+                                             SphinxJSONField,
+                                             UnixTimestampField)
 
 
 CONF_TEMPLATE = '''\
@@ -33,6 +39,7 @@ FIELD_TYPE_MAP = {
         fields.TimeField,
         fields.DateField,
         fields.DateTimeField,
+        UnixTimestampField,
     ),
     'rt_attr_uint': (
         fields.SmallIntegerField,
@@ -50,8 +57,52 @@ FIELD_TYPE_MAP = {
     'rt_attr_bigint': (
         fields.BigIntegerField,
     ),
+    'rt_attr_bool': (
+        fields.BooleanField,
+    ),
+    'rt_attr_multi': (
+        SphinxMultiValueField,
+    ),
+    'rt_attr_multi_64': (
+        SphinxMultiValue64Field,
+    ),
+    'rt_attr_json': (
+        SphinxJSONField,
+    ),
+}
+
+
+# Column types reported by DESCRIBE
+DESCRIBE_TYPE_MAP = {
+    'field': 'rt_field',
+    'uint': 'rt_attr_uint',
+    'integer': 'rt_attr_uint',
+    'bigint': 'rt_attr_bigint',
+    'float': 'rt_attr_float',
+    'bool': 'rt_attr_bool',
+    'timestamp': 'rt_attr_timestamp',
+    'string': 'rt_attr_string',
+    'mva': 'rt_attr_multi',
+    'mva64': 'rt_attr_multi_64',
+    'json': 'rt_attr_json',
 }
 
+# Attributes searchd can add and drop online with ALTER TABLE
+ALTER_TYPE_MAP = {
+    'rt_attr_uint': 'INTEGER',
+    'rt_attr_bigint': 'BIGINT',
+    'rt_attr_float': 'FLOAT',
+    'rt_attr_bool': 'BOOL',
+}
+
+
+def get_field_type(field):
+    """ Returns Sphinx type for the most specific matching field class."""
+    for klass in type(field).__mro__:
+        for field_type, klasses in FIELD_TYPE_MAP.items():
+            if klass in klasses:
+                return field_type
+
 
 def iter_models():
     for app in settings.INSTALLED_APPS:
@@ -75,34 +126,139 @@ def iter_fields(model):
         yield field.name, field
 
 
+def get_model_schema(model):
+    """ Returns {column: sphinx type} for model fields."""
+    schema = SortedDict()
+    for name, field in iter_fields(model):
+        field_type = get_field_type(field)
+        if field_type:
+            schema[field.column] = field_type
+    return schema
+
+
+def get_index_schema(cursor, index_name):
+    """ Returns {column: sphinx type} of running index, None if it is not
+    found."""
+    try:
+        cursor.execute('DESCRIBE %s' % index_name)
+    except (ProgrammingError, OperationalError):
+        return None
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    schema = SortedDict()
+    for row in rows:
+        name, column_type = row[0], row[1]
+        if name == 'id':
+            continue
+        schema[name] = DESCRIBE_TYPE_MAP.get(column_type, column_type)
+    return schema
+
+
+def diff_schema(index_name, model_schema, index_schema):
+    """ Compares model schema with running index.
+
+    Returns (ALTER statements, config changes, reindex reasons): columns of
+    types supported by ALTER TABLE are added and dropped online, config is
+    changed for them too; other changes need index rebuild.
+    """
+    alters, config, reindex = [], [], []
+    for name, field_type in model_schema.items():
+        index_type = index_schema.get(name)
+        if index_type == field_type:
+            continue
+        if index_type is None:
+            if field_type in ALTER_TYPE_MAP:
+                alters.append('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    index_name, name, ALTER_TYPE_MAP[field_type]))
+            else:
+                reindex.append('%s %s added' % (field_type, name))
+            config.append('+ %s = %s' % (field_type, name))
+        else:
+            reindex.append('%s changed from %s to %s' % (
+                name, index_type, field_type))
+            config.append('- %s = %s' % (index_type, name))
+            config.append('+ %s = %s' % (field_type, name))
+    for name, index_type in index_schema.items():
+        if name in model_schema:
+            continue
+        if index_type in ALTER_TYPE_MAP:
+            alters.append('ALTER TABLE %s DROP COLUMN %s' % (index_name, name))
+        else:
+            reindex.append('%s %s removed' % (index_type, name))
+        config.append('- %s = %s' % (index_type, name))
+    return alters, config, reindex
+
+
 class Command(BaseCommand):
     args = ''
-    help = 'Builds a configuration for Sphinx from your Django models.'
+    help = ('Builds a configuration for Sphinx from your Django models, '
+            'with --diff compares it with running indexes.')
     option_list = BaseCommand.option_list + (
         make_option(
             '--directory',
             default = '/var/indexes',
             help = 'Data directory for index data files.',
         ),
+        make_option(
+            '--diff',
+            action = 'store_true',
+            default = False,
+            help = 'Compare models with running indexes (DESCRIBE) and '
+                   'print migration plan.',
+        ),
+        make_option(
+            '--apply',
+            action = 'store_true',
+            default = False,
+            help = 'Execute ALTER TABLE statements of migration plan.',
+        ),
     )
 
     def handle(self, *args, **kwargs):
-        field_types = {}
+        if kwargs.get('diff') or kwargs.get('apply'):
+            return self.handle_diff(**kwargs)
+        for model in iter_models():
+            self.print_config(model, kwargs.get('directory'))
+
+    def print_config(self, model, directory):
+        field_conf = []
+        for field_name, field_type in get_model_schema(model).items():
+            field_conf.append(CONF_FIELD_TEMPLATE % dict(
+                field_name = field_name,
+                indent = '\t' * (3 - len(field_type) / 8),
+                field_type = field_type
+            ))
+        print CONF_TEMPLATE % dict(
+            fields = '\n\t'.join(field_conf),
+            index_name = model._meta.db_table,
+            directory = directory
+        )
+
+    def handle_diff(self, **kwargs):
+        alias = getattr(settings, 'SPHINX_DATABASE_NAME', 'sphinx')
+        cursor = connections[alias].cursor()
         for model in iter_models():
-            for name, field in iter_fields(model):
-                for type, klasses in FIELD_TYPE_MAP.items():
-                    if any(map(lambda klass: isinstance(field, klass), klasses)):
-                        field_types[name] = type
-                        break
-            field_conf = []
-            for field_name, field_type in field_types.items():
-                field_conf.append(CONF_FIELD_TEMPLATE % dict(
-                    field_name = field_name,
-                    indent = '\t' * (3 - len(field_type) / 8),
-                    field_type = field_type
-                ))
-            print CONF_TEMPLATE % dict(
-                fields = '\n\t'.join(field_conf),
-                index_name = model._meta.db_table,
-                directory = kwargs.get('directory')
-            )
+            index_name = model._meta.db_table
+            index_schema = get_index_schema(cursor, index_name)
+            if index_schema is None:
+                print '# %s: index not found, create it with config:' % (
+                    index_name)
+                self.print_config(model, kwargs.get('directory'))
+                continue
+            alters, config, reindex = diff_schema(
+                index_name, get_model_schema(model), index_schema)
+            if not (alters or config):
+                print '# %s: up to date' % index_name
+                continue
+            print '# %s:' % index_name
+            for statement in alters:
+                if kwargs.get('apply'):
+                    cursor.execute(statement)
+                    print '%s; -- applied' % statement
+                else:
+                    print '%s;' % statement
+            for line in config:
+                print '# config: %s' % line
+            for reason in reindex:
+                print '# reindex: %s' % reason
@@ -0,0 +1,106 @@
+import time
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+from django.conf import settings
+from django.db import connections
+from django.core.management.base import BaseCommand, CommandError
+from django_sphinx_db.backend.recorder import read_queries, top_queries
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Replays the most frequent queries recorded by '
+            'SPHINX_QUERY_RECORDER to warm up caches of searchd node.')
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--alias',
+            default = None,
+            help = 'Database alias of node, SPHINX_DATABASE_NAME by default.',
+        ),
+        make_option(
+            '--file',
+            default = None,
+            help = 'Recorded queries file, SPHINX_QUERY_RECORDER path by '
+                   'default.',
+        ),
+        make_option(
+            '--top',
+            type = 'int',
+            default = 100,
+            help = 'Number of the most frequent query shapes to replay.',
+        ),
+        make_option(
+            '--variants',
+            type = 'int',
+            default = 3,
+            help = 'Number of the most frequent parameters for each shape.',
+        ),
+        make_option(
+            '--concurrency',
+            type = 'int',
+            default = 4,
+            help = 'Number of queries executed in parallel.',
+        ),
+        make_option(
+            '--rate',
+            type = 'float',
+            default = 0,
+            help = 'Maximum queries per second, unlimited by default.',
+        ),
+    )
+
+    def handle(self, *args, **kwargs):
+        alias = kwargs.get('alias') or getattr(
+            settings, 'SPHINX_DATABASE_NAME', 'sphinx')
+        path = kwargs.get('file') or getattr(
+            settings, 'SPHINX_QUERY_RECORDER', {}).get('path')
+        if not path:
+            raise CommandError('Recorded queries file is not set')
+        queries = top_queries(read_queries(path), kwargs.get('top'),
+                              kwargs.get('variants'))
+        rate = kwargs.get('rate')
+
+        def paced():
+            started = time.time()
+            for i, query in enumerate(queries):
+                if rate:
+                    delay = started + i / rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                yield query
+
+        def execute(query):
+            # each pool thread uses own connection
+            started = time.time()
+            cursor = connections[alias].cursor()
+            try:
+                cursor.execute(*query)
+                cursor.fetchall()
+            except Exception as e:
+                return None, '%s: %s' % (query[0], e)
+            finally:
+                cursor.close()
+            return time.time() - started, None
+
+        pool = ThreadPool(max(kwargs.get('concurrency'), 1))
+        latencies = []
+        try:
+            for latency, error in pool.imap_unordered(execute, paced()):
+                if error is not None:
+                    self.stderr.write(error)
+                else:
+                    latencies.append(latency)
+        finally:
+            pool.close()
+            pool.join()
+        self.print_stats(alias, len(queries), latencies)
+
+    def print_stats(self, alias, total, latencies):
+        print '%s: %d queries, %d failed' % (alias, total,
+                                             total - len(latencies))
+        if latencies:
+            latencies.sort()
+            print 'p50 %.1f ms, p95 %.1f ms, max %.1f ms' % (
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.95)] * 1000,
+                latencies[-1] * 1000)
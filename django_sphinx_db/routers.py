@@ -22,8 +22,20 @@ class SphinxRouter(object):
 
     def db_for_write(self, model, **kwargs):
         if self.is_sphinx_model(model):
+            from django_sphinx_db.backend.sharding import get_policy
+            policy = get_policy(model)
+            instance = kwargs.get('instance')
+            if policy is not None and instance is not None:
+                alias = policy.get_instance_alias(instance)
+                if alias is not None:
+                    return alias
             return getattr(settings, 'SPHINX_DATABASE_NAME', 'sphinx')
 
     def allow_relation(self, obj1, obj2, **kwargs):
         # Allow all relations...
         return True
+
+
+def get_replicas(alias):
+    """ Returns aliases of replicas serving the same indexes as alias."""
+    return getattr(settings, 'SPHINX_REPLICAS', {}).get(alias, [])
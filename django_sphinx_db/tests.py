@@ -1,12 +1,42 @@
 # coding: utf-8
+import os
+import socket
+import tempfile
 import mock
+from datetime import date, datetime, timedelta
 from MySQLdb import OperationalError
 
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 from django.test.utils import override_settings
-from django.db import models
+from django.db import models, ProgrammingError
 from django.db.models import Sum
+from django.db.models.sql.constants import MULTI
 from backend.models import SphinxModel, sphinx_escape, SphinxQuerySet
+from backend.models import SphinxField
+from backend.union import sphinx_union
+from backend.cost import assert_query_cost, QueryCostError
+from backend.fields import SphinxMultiValueField, SphinxJSONField
+from backend.fields import UnixTimestampField, EPOCH, to_timestamps
+from backend.sphinx.expressions import Expr, Weight, Ranker, Weights
+from backend.cache import LRUCache
+from backend.sphinx.match import Term, Phrase, Field
+from backend.chunks import split_values, map_in_pool
+from backend import arrays
+from backend.memo import query_memo, invalidate_memo
+from backend.deadline import sphinx_deadline, get_deadline
+from backend import hedging
+from backend.hedging import Tracker
+from backend.sharding import ShardPolicy, get_policy
+from routers import SphinxRouter
+from management.commands.syncsphinx import diff_schema, get_model_schema
+from management.commands.syncsphinx import get_index_schema
+from management.commands import sphinxmaintenance
+from backend.maintenance import Scheduler, DEFAULTS
+from backend.recorder import QueryRecorder, read_queries, top_queries
+from backend.sphinx.compiler import SphinxQLCompiler
+from benchmarks import runner
+from django.utils import unittest
 
 
 class TagsIndex(SphinxModel):
@@ -31,6 +61,58 @@ class VideoIndex(SphinxModel):
     title = models.CharField(max_length=255)
 
 
+class DocumentIndex(SphinxModel):
+    """ Модель индекса документов с MVA-атрибутами."""
+
+    class Meta:
+        managed = False
+        db_table = 'squirrel_document_idx'
+
+    id = models.IntegerField(primary_key=True)
+    title = models.CharField(max_length=255)
+    tags = SphinxMultiValueField()
+    meta = SphinxJSONField()
+
+
+class ClipIndex(SphinxModel):
+    """ Модель индекса роликов для поиска по нескольким индексам."""
+
+    class Meta:
+        managed = False
+        db_table = 'squirrel_clip_idx'
+
+    id = models.IntegerField(primary_key=True)
+    title = SphinxField()
+    index_marker = models.IntegerField(default=1)
+    views = models.IntegerField()
+
+
+class ChannelIndex(SphinxModel):
+    """ Модель индекса каналов для поиска по нескольким индексам."""
+
+    class Meta:
+        managed = False
+        db_table = 'squirrel_channel_idx'
+
+    id = models.IntegerField(primary_key=True)
+    name = SphinxField()
+    subscribers = models.IntegerField()
+    views = models.IntegerField()
+    index_marker = models.IntegerField(default=2)
+
+
+class PlaceIndex(SphinxModel):
+    """ Модель индекса мест с координатами в радианах."""
+
+    class Meta:
+        managed = False
+        db_table = 'squirrel_place_idx'
+
+    id = models.IntegerField(primary_key=True)
+    lat = models.FloatField()
+    lon = models.FloatField(db_column='lng')
+
+
 from django.test.simple import DjangoTestSuiteRunner
 
 
@@ -63,6 +145,20 @@ class BackendTestCase(TestCase):
 
         self.escaped_match = r"MATCH('\^abc')"
         self.query = "^abc"
+        self.temp_paths = []
+
+    def tearDown(self):
+        for path in self.temp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        super(BackendTestCase, self).tearDown()
+
+    def mkstemp(self):
+        """ Returns path of temporary file removed after test."""
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.temp_paths.append(path)
+        return path
 
     def assertQueryExecuted(self, qs, substr=None):
         query = str(qs.query)
@@ -239,3 +335,507 @@ class BackendTestCase(TestCase):
         expected = "Conan O\\'Brien"
         # real expected value == "Conan O\'Brien"
         self.assertEqual(expected, sphinx_escape(query))
+
+    def testSliceMaxMatches(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query))[2000:2010]
+        self.assertQueryExecuted(qs, 'OPTION max_matches=3000')
+
+    @override_settings(SPHINX_MAX_MATCHES_LIMIT=5000)
+    def testSliceMaxMatchesLimit(self):
+        qs = TagsIndex.objects.all()[5000:5010]
+        with self.assertRaises(ValueError):
+            str(qs.query)
+
+    def testExplicitMaxMatches(self):
+        qs = TagsIndex.objects.options(max_matches=5000)[2000:2010]
+        self.assertQueryExecuted(qs, 'OPTION max_matches=5000')
+
+    def testCountWithMeta(self):
+        qs = TagsIndex.objects.match(u'"ТВ"'.encode('utf-8'))
+        total = qs.count()
+        qs = qs.with_meta()
+        list(qs)
+        self.assertEqual(int(qs.meta['total_found']), total)
+        with mock.patch('django_sphinx_db.backend.models.show_meta') as patched:
+            self.assertEqual(qs.count(), total)
+            self.assertFalse(patched.called)
+
+    def testEmptyCount(self):
+        with mock.patch('django_sphinx_db.backend.models.show_meta') as patched:
+            self.assertEqual(TagsIndex.objects.filter(id__in=[]).count(), 0)
+            self.assertFalse(patched.called)
+
+    def testLimitedCount(self):
+        qs = TagsIndex.objects.all()
+        self.assertEqual(qs[:1].count(), 1)
+        self.assertTrue(qs.exists())
+
+    def testFacet(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query)).facet(
+            'id', order_by=('-count',), limit=5)
+        self.assertQueryExecuted(
+            qs, 'FACET id ORDER BY COUNT(*) DESC LIMIT 5')
+        self.assertIn('id', qs.facets)
+        self.assertLessEqual(len(qs.facets['id']), 5)
+
+    def testMultiValueLookups(self):
+        qs = DocumentIndex.objects.filter(tags__in=[1, 2])
+        self.assertIn('tags IN (1, 2)', str(qs.query))
+        qs = DocumentIndex.objects.filter(tags__all=[1, 2])
+        self.assertIn('tags = 1 AND tags = 2', str(qs.query))
+
+    def testMultiValueConversion(self):
+        doc = DocumentIndex(id=1, tags='3,1,2')
+        self.assertEqual(doc.tags, set([1, 2, 3]))
+        field = DocumentIndex._meta.get_field('tags')
+        self.assertEqual(field.get_prep_value(doc.tags), (1, 2, 3))
+
+    def testJSONPathLookups(self):
+        qs = DocumentIndex.objects.filter(meta__rights__ru__gte=10)
+        self.assertIn('meta.rights.ru >= 10', str(qs.query))
+        qs = DocumentIndex.objects.exclude(meta__sizes__0__in=[1, 2])
+        self.assertIn('meta.sizes[0] NOT IN (1, 2)', str(qs.query))
+        qs = DocumentIndex.objects.order_by('-meta.popularity')
+        self.assertIn('ORDER BY meta.popularity DESC', str(qs.query))
+
+    def testJSONConversion(self):
+        doc = DocumentIndex(id=1, meta='{"rights": {"ru": 1}}')
+        self.assertEqual(doc.meta, {'rights': {'ru': 1}})
+        field = DocumentIndex._meta.get_field('meta')
+        self.assertEqual(field.get_prep_value(doc.meta), '{"rights":{"ru":1}}')
+
+    def testRankingExpressions(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query)).annotate(
+            weight=Weight(), rank=Weight() * 0.7 + Expr('LN(id)') * 0.3
+        ).order_by('-rank')
+        self.assertQueryExecuted(
+            qs, 'WEIGHT() * 0.7 + LN(id) * 0.3 AS rank')
+        self.assertIn('ORDER BY rank DESC', str(qs.query))
+        for tag in qs:
+            self.assertTrue(hasattr(tag, 'weight'))
+
+    def testRankingOptions(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query)).options(
+            ranker=Ranker.expr('sum(lcs*user_weight)*1000+bm25'),
+            field_weights=Weights(name=10))
+        self.assertQueryExecuted(
+            qs, "ranker=expr('sum(lcs*user_weight)*1000+bm25')")
+        self.assertIn('field_weights=(name=10)', str(qs.query))
+
+    def testRankerEscaping(self):
+        self.assertEqual(Ranker.expr("sum(lcs)+'\\'").as_sql(),
+                         "expr('sum(lcs)+\\'\\\\\\'')")
+
+    def testSnippets(self):
+        qs = TagsIndex.objects.match(u'"ТВ"'.encode('utf-8'))
+        docs = [u'Новости ТВ', u'Без совпадений']
+        snippets = qs.snippets(docs, before_match='<b>', after_match='</b>')
+        self.assertEqual(len(snippets), 2)
+        self.assertIn(u'<b>', snippets[0].decode('utf-8'))
+
+    def testSnippetsQueryMode(self):
+        qs = TagsIndex.objects.match('cat', name='dog')
+        with mock.patch('django_sphinx_db.backend.models.connections') as c:
+            qs.snippets(['cat and dog'], limit=100)
+            cursor = c.__getitem__.return_value.cursor.return_value
+            sql, params = cursor.execute.call_args[0]
+            self.assertIn('%s AS query_mode', sql)
+            self.assertEqual(params[-2:], [100, 1])
+            qs.snippets(['cat and dog'], query='cat')
+            sql, params = cursor.execute.call_args[0]
+            self.assertNotIn('query_mode', sql)
+
+    def testKeywordsCached(self):
+        keywords = TagsIndex.objects.keywords(u'Новость  ДНЯ', hits=True)
+        self.assertEqual(len(keywords), 2)
+        self.assertIn('docs', keywords[0])
+        with mock.patch('django.db.backends.mysql.base.DatabaseWrapper.cursor') as patched:
+            self.assertEqual(
+                TagsIndex.objects.keywords(u'новость дня', hits=True), keywords)
+            self.assertFalse(patched.called)
+
+    def testLRUCache(self):
+        now = [0]
+        cache = LRUCache(maxsize=2, ttl=10, timer=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+
+    def testMatchTree(self):
+        qs = TagsIndex.objects.match(
+            (Term('cat') | Phrase('funny dog', proximity=2)) & ~Term('fake'))
+        self.assertQueryExecuted(qs, 'MATCH(\'cat|"funny dog"~2 -fake\')')
+
+    def testMatchFieldScopeWrapped(self):
+        node = Field('title', Term('cat')) & Term('dog')
+        self.assertEqual(node.as_sphinx(), u'(@title (cat)) dog')
+        node = Term('dog') | ~Field('title', Term('cat'))
+        self.assertEqual(node.as_sphinx(), u'dog|-(@title (cat))')
+        self.assertEqual(Field('title', Term('cat')).as_sphinx(),
+                         u'@title (cat)')
+
+    def testMatchFieldScopesMerged(self):
+        qs = TagsIndex.objects.filter(name=u"Котики").match(
+            name=u"Котики").exclude(name=u"Новость дня")
+        self.assertQueryExecuted(qs, u'@name ("Котики" -"Новость дня")')
+
+    def testMatchChainedFilters(self):
+        qs = TagsIndex.objects.filter(name='a').filter(name='b').exclude(
+            name='c')
+        self.assertIn(u'@name ("a"|"b" -"c")', str(qs.query).decode('utf-8'))
+        qs = TagsIndex.objects.exclude(name='a').exclude(name__in=['b', 'c'])
+        self.assertIn(u'@name (-("a"|"b"|"c"))',
+                      str(qs.query).decode('utf-8'))
+
+    def testMatchNotShared(self):
+        qs = TagsIndex.objects.match('first')
+        qs.match('second')
+        self.assertNotIn('second', str(qs.query))
+
+    def testChunkedInLookup(self):
+        ids = list(TagsIndex.objects.values_list('id', flat=True)[:20])
+        qs = TagsIndex.objects.filter(id__in=ids).order_by('-id')
+        expected = [tag.id for tag in qs]
+        with self.settings(SPHINX_IN_CHUNK_SIZE=3, SPHINX_IN_RANGE_MIN=5):
+            qs = TagsIndex.objects.filter(id__in=ids).order_by('-id')
+            self.assertEqual([tag.id for tag in qs], expected)
+            self.assertEqual(qs.count(), len(expected))
+            self.assertEqual([tag.id for tag in qs[2:5]], expected[2:5])
+
+    def testChunkedInLookupQueries(self):
+        ids = range(1, 21)
+        with self.settings(SPHINX_IN_CHUNK_SIZE=3, SPHINX_IN_RANGE_MIN=50):
+            qs = TagsIndex.objects.filter(id__in=ids)
+            sql = str(qs.query)
+            # relevance order can't be reproduced while merging chunks
+            self.assertIsNone(qs._get_chunk_querysets())
+            self.assertEqual(len(qs._get_chunk_querysets(with_limits=False)),
+                             7)
+            qs = qs.order_by('-id')
+            chunk_querysets = qs._get_chunk_querysets()
+            self.assertEqual(len(chunk_querysets), 7)
+            self.assertEqual(str(qs.query), sql + ' ORDER BY id DESC')
+            self.assertNotIn('20', str(chunk_querysets[0].query))
+
+    def testSplitValues(self):
+        values = range(10, 20) + [30, 32, 34]
+        self.assertEqual(split_values(values, 2, range_min=5, range_max=6), [
+            ('range', (10, 15)), ('range', (16, 19)),
+            ('in', [30, 32]), ('in', [34])])
+
+    def testStream(self):
+        qs = TagsIndex.objects.all().order_by('id')[:100]
+        expected = [tag.id for tag in qs]
+        qs = qs.with_meta()
+        self.assertEqual([tag.id for tag in qs.stream(chunk_size=7)], expected)
+        self.assertIn('total_found', qs.meta)
+        rows = list(qs.stream(chunk_size=7, tuples=True))
+        self.assertEqual([row[0] for row in rows], expected)
+
+    @unittest.skipIf(arrays.numpy is None, "NumPy is not installed")
+    def testToArrays(self):
+        qs = TagsIndex.objects.all().order_by('id')[:100]
+        expected = list(qs.values_list('id', flat=True))
+        result = qs.to_arrays('id', chunk_size=7)
+        self.assertEqual(result.keys(), ['id'])
+        self.assertEqual(result['id'].dtype, arrays.numpy.int64)
+        self.assertEqual(list(result['id']), expected)
+        self.assertRaises(ValueError, qs.to_arrays, 'name')
+
+    @override_settings(USE_TZ=True, TIME_ZONE='Europe/Moscow')
+    def testUnixTimestampConversion(self):
+        field = UnixTimestampField()
+        self.assertEqual(field.to_python(86400), EPOCH + timedelta(days=1))
+        self.assertEqual(field.to_python('1970-01-01T03:00:00'), EPOCH)
+        # naive datetime is in default time zone
+        self.assertEqual(field.get_prep_value(datetime(1970, 1, 1, 3)), 0)
+        self.assertEqual(field.get_prep_value(EPOCH), 0)
+        self.assertEqual(to_timestamps([EPOCH, datetime(1970, 1, 1, 4), 5,
+                                        None]), [0, 3600, 5, None])
+        self.assertEqual(to_timestamps([date(1970, 1, 2)]), [75600])
+        self.assertEqual(field.get_db_prep_batch(
+            ['86400', '1970-01-01T03:00:00', date(1970, 1, 1)]),
+            [86400, 0, -10800])
+        self.assertEqual(field.to_python_batch([0, None, 86400]),
+                         [EPOCH, None, EPOCH + timedelta(days=1)])
+
+    def testRows(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query)).annotate(
+            weight=Weight()).order_by('id')
+        rows = qs.rows()
+        self.assertEqual([(r.id, r.name) for r in rows],
+                         [(t.id, t.name) for t in qs])
+        for row in rows:
+            self.assertTrue(hasattr(row, 'weight'))
+        row = qs.rows('id', 'weight')[0]
+        self.assertEqual(row._fields, ('id', 'weight'))
+        self.assertEqual(row.id, rows[0].id)
+
+    def testPoolMemo(self):
+        with query_memo() as memo:
+            memo.get('key', lambda: 1)
+            # writes executed by pool threads invalidate memo of request
+            map_in_pool(lambda i: invalidate_memo(), [1, 2])
+            self.assertEqual(len(memo), 0)
+
+    def testRowsColumns(self):
+        statements = []
+
+        def results_iter(compiler):
+            statements.append(compiler.as_sql()[0])
+            compiler.query.meta_results = {'total_found': '1'}
+            return iter([(1.5, 7, 1, 100)])
+        qs = ClipIndex.objects.match('cat').annotate(weight=Weight())
+        with mock.patch.object(SphinxQLCompiler, 'results_iter',
+                               results_iter):
+            with mock.patch('django_sphinx_db.backend.models.show_meta') \
+                    as show_meta:
+                qs = qs.with_meta()
+                rows = qs.rows()
+                self.assertFalse(show_meta.called)
+        # full-text fields are not selected
+        self.assertNotIn('title', statements[0])
+        self.assertEqual(rows[0]._fields,
+                         ('id', 'index_marker', 'views', 'weight'))
+        self.assertEqual(rows[0].weight, 1.5)
+        self.assertEqual(qs.meta, {'total_found': '1'})
+
+    def testQueryMemo(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query))
+        with query_memo() as memo:
+            expected = list(qs.all())
+            count = qs.all().count()
+            with mock.patch.object(SphinxQLCompiler, 'fetch_results') as fetch:
+                self.assertEqual(list(qs.all()), expected)
+                self.assertEqual(qs.all().count(), count)
+            self.assertFalse(fetch.called)
+            self.assertEqual(len(memo), 2)
+            memo.invalidate()
+            self.assertEqual(list(qs.all()), expected)
+            self.assertEqual(len(memo), 1)
+
+    def testDeadline(self):
+        qs = TagsIndex.objects.match(sphinx_escape(self.query))
+        with sphinx_deadline(1000) as deadline:
+            self.assertIn('max_query_time=', str(qs.query))
+            self.assertIn('max_query_time=10',
+                          str(qs.options(max_query_time=10).query))
+            list(qs)
+            self.assertFalse(deadline.exceeded)
+        with sphinx_deadline(0) as deadline:
+            self.assertEqual(list(qs.all()), [])
+            self.assertEqual(qs.all().count(), 0)
+            self.assertTrue(deadline.exceeded)
+        with sphinx_deadline(0) as deadline:
+            self.assertEqual(list(qs.stream()), [])
+            self.assertTrue(deadline.exceeded)
+        # chunk queries executed by pool threads respect the budget
+        statements = []
+
+        def execute_sql(compiler, result_type=MULTI):
+            statements.append(compiler.as_sql()[0])
+            return iter([])
+        qs = TagsIndex.objects.filter(id__in=range(0, 40, 2)).order_by('id')
+        with self.settings(SPHINX_IN_CHUNK_SIZE=3):
+            with mock.patch.object(SphinxQLCompiler, 'execute_sql',
+                                   execute_sql):
+                with sphinx_deadline(1000):
+                    list(qs.all())
+            self.assertEqual(len(statements), 7)
+            for sql in statements:
+                self.assertIn('max_query_time=', sql)
+            with sphinx_deadline(0) as deadline:
+                self.assertEqual(list(qs.all()), [])
+                self.assertEqual(qs.count(), 0)
+                self.assertTrue(deadline.exceeded)
+
+    def testHedgeTracker(self):
+        tracker = Tracker(window=100, max_rate=0.1)
+        self.assertEqual(tracker.get_delay(0.05), 0.05)
+        for i in range(100):
+            tracker.add_latency(i / 1000.0)
+        self.assertEqual(tracker.get_delay(0.05), 0.095)
+        allowed = 0
+        for i in range(100):
+            tracker.start_request()
+            allowed += tracker.allow_hedge()
+        # initial token and one per 10 requests
+        self.assertEqual(allowed, 11)
+        self.assertEqual(tracker.stats()['hedges_fired'], 11)
+
+    def testHedgedExecute(self):
+        primary, replica = mock.Mock(alias='sphinx'), mock.Mock(alias='r')
+        primary.connection._sock, sock = socket.socketpair()
+        deadlines = []
+
+        def func(connection):
+            if connection is primary:
+                # blocks until socket is shut down by winning hedge
+                if not connection.connection._sock.recv(1):
+                    raise OperationalError(2013, 'Lost connection')
+                return 'primary'
+            deadlines.append(get_deadline())
+            return 'replica'
+        connections = {'sphinx': primary, 'r': replica}
+        with mock.patch.object(hedging, 'connections', connections):
+            with sphinx_deadline(1000) as deadline:
+                result = hedging.execute('sphinx', ['r'], func)
+        self.assertEqual(result, 'replica')
+        self.assertEqual(deadlines, [deadline])
+        self.assertTrue(primary.close.called)
+        self.assertEqual(hedging.get_tracker('sphinx').won, 1)
+        # MySQLdb connection can't be interrupted by winning hedge
+        primary.connection = mock.Mock(spec=[])
+        with mock.patch.object(hedging, 'connections', connections):
+            self.assertRaises(ImproperlyConfigured, hedging.execute,
+                              'sphinx', ['r'], func)
+
+    def testShardPolicy(self):
+        policy = ShardPolicy(['a', 'b'])
+        self.assertEqual([policy.get_alias(v) for v in range(4)],
+                         ['a', 'b', 'a', 'b'])
+        self.assertEqual(policy.group_values([1, 2, 3]),
+                         {'b': [1, 3], 'a': [2]})
+        policy = ShardPolicy(['a', 'b', 'c'], function='range',
+                             ranges=[10, 20])
+        self.assertEqual([policy.get_alias(v) for v in (0, 10, 19, 20)],
+                         ['a', 'b', 'b', 'c'])
+        self.assertRaises(ValueError, ShardPolicy, ['a', 'b'],
+                          function='range', ranges=[])
+
+    @override_settings(SPHINX_SHARDS={
+        'django_sphinx_db.TagsIndex': {'aliases': ['sphinx1', 'sphinx2']}})
+    def testShardRouting(self):
+        router = SphinxRouter()
+        self.assertEqual(router.db_for_write(
+            TagsIndex, instance=TagsIndex(id=3)), 'sphinx2')
+        qs = TagsIndex.objects.filter(id__in=[1, 2, 3])
+        self.assertEqual(
+            sorted((q._db, str(q.query)) for q in qs._get_shard_querysets()),
+            [('sphinx1', 'SELECT id, name FROM squirrel_tags_idx '
+                         'WHERE id IN (2)'),
+             ('sphinx2', 'SELECT id, name FROM squirrel_tags_idx '
+                         'WHERE id IN (1, 3)')])
+        self.assertIs(get_policy(TagsIndex), get_policy(TagsIndex))
+        with self.settings(SPHINX_SHARDS=None):
+            self.assertIsNone(get_policy(TagsIndex))
+
+    def testSchemaDiff(self):
+        self.assertEqual(get_model_schema(DocumentIndex).items(), [
+            ('title', 'rt_attr_string'), ('tags', 'rt_attr_multi'),
+            ('meta', 'rt_attr_json')])
+        alters, config, reindex = diff_schema('idx', {
+            'views': 'rt_attr_uint', 'title': 'rt_field'
+        }, {'title': 'rt_field', 'rank': 'rt_attr_float',
+            'tags': 'rt_attr_multi'})
+        self.assertEqual(alters, ['ALTER TABLE idx ADD COLUMN views INTEGER',
+                                  'ALTER TABLE idx DROP COLUMN rank'])
+        self.assertEqual(reindex, ['rt_attr_multi tags removed'])
+        self.assertIn('- rt_attr_multi = tags', config)
+
+    def testIndexSchemaNotFound(self):
+        cursor = mock.Mock()
+        # errors are translated to django.db ones by CursorWrapper
+        cursor.execute.side_effect = ProgrammingError('unknown local index')
+        self.assertIsNone(get_index_schema(cursor, 'idx'))
+
+    def testMaintenanceScheduler(self):
+        now = [0]
+        scheduler = Scheduler(DEFAULTS, timer=lambda: now[0])
+        fine = {'ram_bytes': 1 << 30, 'ram_chunk': 1024, 'disk_chunks': 2}
+        chunked = {'ram_chunk': 1 << 30, 'disk_chunks': 20}
+        killed = {'indexed_documents': 70, 'killed_documents': 30}
+        self.assertEqual(scheduler.schedule(fine), None)
+        self.assertEqual(scheduler.schedule(chunked), 'optimize')
+        # the next merge is postponed
+        self.assertEqual(scheduler.schedule(killed), None)
+        now[0] = DEFAULTS['stagger']
+        self.assertEqual(scheduler.schedule(killed), 'optimize')
+        now[0] *= 2
+        self.assertEqual(scheduler.schedule({'ram_chunk': 1 << 30}), 'flush')
+
+    def testMaintenanceFailedAlias(self):
+        failed = mock.Mock()
+        failed.cursor.return_value.execute.side_effect = ProgrammingError(
+            'unknown local index')
+        available = mock.Mock()
+        cursor = available.cursor.return_value
+        cursor.fetchall.return_value = [('disk_chunks', '20')]
+        command = sphinxmaintenance.Command()
+        with mock.patch.object(sphinxmaintenance, 'connections',
+                               {'failed': failed, 'available': available}):
+            command.poll(Scheduler(DEFAULTS), [('idx', 'failed'),
+                                               ('idx', 'available')])
+        self.assertTrue(failed.cursor.return_value.close.called)
+        cursor.execute.assert_called_with('OPTIMIZE INDEX idx')
+
+    def testBenchmarkAllocations(self):
+        with mock.patch.object(runner, 'tracemalloc', None):
+            result = runner.measure(lambda: [], min_time=0, repeat=1)
+        # allocations can't be measured without tracemalloc
+        self.assertIsNone(result['allocated'])
+        self.assertNotIn('B/op', runner.format_results({'case': result}))
+
+    def testQueryRecorder(self):
+        path = self.mkstemp()
+        recorder = QueryRecorder(path, sample_rate=1)
+        for i in range(3):
+            recorder.record('SELECT * FROM idx WHERE id = %s', (1,))
+        recorder.record('SELECT * FROM idx WHERE id = %s', (2,))
+        recorder.record('SELECT * FROM idx', ())
+        recorder.flush()
+        recorder.record('SELECT * FROM idx WHERE id = %s', (2,))
+        recorder.flush()
+        counts = read_queries(path)
+        self.assertEqual(counts['SELECT * FROM idx WHERE id = %s', (2,)], 2)
+        self.assertEqual(top_queries(counts, 1, 1),
+                         [('SELECT * FROM idx WHERE id = %s', (1,))])
+
+    def testUnion(self):
+        union = sphinx_union(ClipIndex.objects.match('cat'),
+                             ChannelIndex.objects.match('cat'))[:10]
+        self.assertEqual(union.as_sql(), (
+            "SELECT WEIGHT() AS weight, id, index_marker, views "
+            "FROM squirrel_clip_idx, squirrel_channel_idx "
+            "WHERE MATCH('cat') ORDER BY weight DESC LIMIT 10", ()))
+        union = sphinx_union(ClipIndex.objects.match('cat'),
+                             ChannelIndex.objects.match('dog'))
+        self.assertRaises(ValueError, union.as_sql)
+
+    def testNear(self):
+        qs = PlaceIndex.objects.order_by('-id').near(
+            'lat', 'lon', (0.97, 0.65), radius=1000)
+        self.assertEqual(str(qs.query), (
+            "SELECT GEODIST(lat, lng, 0.97, 0.65) AS distance, id, lat, lng "
+            "FROM squirrel_place_idx WHERE distance <= 1000.0 "
+            "ORDER BY distance ASC, id DESC"))
+        qs = PlaceIndex.objects.near('lat', 'lon', (55.7, 37.6), degrees=True)
+        self.assertEqual(str(qs.values_list('id').query), (
+            "SELECT id, GEODIST(lat, lng, 55.7, 37.6, {in=degrees}) AS distance "
+            "FROM squirrel_place_idx ORDER BY distance ASC"))
+
+    def testQueryCost(self):
+        assert_query_cost(TagsIndex.objects.match('cat'), 'low')
+        assert_query_cost(TagsIndex.objects.filter(id=3), 'low')
+        assert_query_cost(TagsIndex.objects.filter(id__gt=3), 'medium')
+        assert_query_cost(TagsIndex.objects.match('cat')[:5000], 'medium')
+        assert_query_cost(TagsIndex.objects.notequal(name='cat'), 'high')
+        assert_query_cost(TagsIndex.objects.match('cat').group_by('name'),
+                          'high')
+        with override_settings(SPHINX_QUERY_COST={'raise': 'high'}):
+            qs = TagsIndex.objects.match('cat').filter(id__in=range(2000))
+            self.assertRaises(QueryCostError, list, qs)
+        with self.settings(SPHINX_QUERY_COST={'raise': 'high'},
+                           SPHINX_COST_MAX_IN=10, SPHINX_IN_CHUNK_SIZE=3):
+            # chunks have short IN lists, but the whole list is checked
+            qs = TagsIndex.objects.filter(id__in=range(0, 40, 2))
+            self.assertRaises(QueryCostError, list, qs.order_by('id'))
+            self.assertRaises(QueryCostError, qs.count)
+        with self.settings(SPHINX_IN_CHUNK_SIZE=3):
+            chunk_querysets = qs.order_by('id')._get_chunk_querysets()
+            self.assertTrue(chunk_querysets[0].query.cost_checked)
@@ -7,6 +7,7 @@ setup(
         "django_sphinx_db",
         "django_sphinx_db.backend",
         "django_sphinx_db.backend.sphinx",
+        "django_sphinx_db.benchmarks",
         "django_sphinx_db.management",
         "django_sphinx_db.management.commands",
     ],